@@ -0,0 +1,240 @@
+#!/usr/bin/python3
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Benchmarks a whole collect run of ovirt-log-collector against simulated
+hypervisors: ssh, scp and sos are replaced by standin.py and the engine
+API by an inventory file, so it runs on any Linux box with the
+ovirt_log_collector package importable.
+
+For each number of hosts, reports the wall time, the peak RSS and number
+of file descriptors of the collector, how many hosts were collected and
+the throughput.
+"""
+
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from optparse import OptionParser
+
+from standin import DEFAULT_PROFILE
+
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+STANDINS = ("ssh", "scp", "sos", "sosreport")
+POLL_INTERVAL = 0.05
+HOSTS_PER_CLUSTER = 50
+CLUSTERS_PER_DATACENTER = 10
+
+COLUMNS = (
+    ("hosts", "%6d"),
+    ("wall_seconds", "%9.1f"),
+    ("peak_rss_mib", "%9.1f"),
+    ("peak_fds", "%6d"),
+    ("collected", "%6d"),
+    ("archive_mib", "%9.1f"),
+    ("mib_per_second", "%7.1f"),
+    ("hosts_per_second", "%7.1f"),
+    ("exit_code", "%4d"),
+)
+HEADERS = ("hosts", "wall s", "RSS MiB", "fds", "done", "arch MiB",
+           "MiB/s", "hosts/s", "exit")
+
+
+def write_inventory(path, count):
+    hosts = []
+    for i in range(count):
+        cluster = i // HOSTS_PER_CLUSTER
+        datacenter = cluster // CLUSTERS_PER_DATACENTER
+        hosts.append((
+            "dc%03d" % datacenter,
+            ("cluster-%04d" % cluster, "cluster%04d" % cluster, False),
+            "host%05d.bench.invalid" % i,
+            # The first host of each data center is its SPM
+            i % (HOSTS_PER_CLUSTER * CLUSTERS_PER_DATACENTER) == 0,
+            True,
+        ))
+    with open(path, "w") as inventory:
+        json.dump(hosts, inventory)
+
+
+def read_proc(pid):
+    """
+    Returns the peak RSS in KiB and the open file descriptors of pid, or
+    None if it is gone.
+    """
+    try:
+        fds = len(os.listdir("/proc/%d/fd" % pid))
+        with open("/proc/%d/status" % pid) as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]), fds
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+def run(count, options, extra_args):
+    workdir = tempfile.mkdtemp(prefix="olc-bench-")
+    try:
+        bindir = os.path.join(workdir, "bin")
+        os.mkdir(bindir)
+        for name in STANDINS:
+            os.symlink(
+                os.path.join(BENCH_DIR, "standin.py"),
+                os.path.join(bindir, name)
+            )
+        inventory = os.path.join(workdir, "inventory.json")
+        write_inventory(inventory, count)
+        profile = os.path.join(workdir, "profile.json")
+        with open(profile, "w") as profile_file:
+            json.dump(options.profile, profile_file)
+        output = os.path.join(workdir, "output")
+
+        env = dict(os.environ)
+        env["PATH"] = bindir + os.pathsep + env.get("PATH", "")
+        env["OLC_BENCH_INVENTORY"] = inventory
+        env["OLC_BENCH_PROFILE"] = profile
+        env["OLC_BENCH_CACHE_DIR"] = os.path.join(workdir, "cache")
+        cmd = [
+            sys.executable,
+            os.path.join(BENCH_DIR, "collector.py"),
+            "--batch",
+            "--quiet",
+            "--no-postgresql",
+            "--inventory-cache-ttl=0",
+            "--ssh-bin-dir=%s" % bindir,
+            "--local-tmp=%s" % os.path.join(workdir, "tmp"),
+            "--output=%s" % output,
+            "--log-file=%s" % os.path.join(workdir, "collector.log"),
+            "--max-connections=%d" % options.max_connections,
+        ] + extra_args + ["collect"]
+
+        peak_rss = peak_fds = 0
+        started = time.monotonic()
+        with open(os.path.join(workdir, "stdout"), "w") as stdout:
+            proc = subprocess.Popen(
+                cmd,
+                env=env,
+                stdin=subprocess.DEVNULL,
+                stdout=stdout,
+                stderr=subprocess.STDOUT,
+            )
+            while proc.poll() is None:
+                usage = read_proc(proc.pid)
+                if usage is not None:
+                    peak_rss = max(peak_rss, usage[0])
+                    peak_fds = max(peak_fds, usage[1])
+                time.sleep(POLL_INTERVAL)
+        wall = time.monotonic() - started
+
+        collected = 0
+        archive_size = 0
+        for manifest_path in glob.glob(
+            os.path.join(output, "*.manifest.json")
+        ):
+            with open(manifest_path) as manifest:
+                collected = sum(
+                    1 for host in json.load(manifest)["hosts"].values()
+                    if host.get("report")
+                )
+            archive_size = os.path.getsize(
+                manifest_path[:-len(".manifest.json")]
+            )
+        if options.keep:
+            sys.stderr.write("%d hosts: kept %s\n" % (count, workdir))
+        return {
+            "hosts": count,
+            "wall_seconds": wall,
+            "peak_rss_mib": peak_rss / 1024.0,
+            "peak_fds": peak_fds,
+            "collected": collected,
+            "archive_mib": archive_size / float(1 << 20),
+            "mib_per_second": archive_size / float(1 << 20) / wall,
+            "hosts_per_second": collected / wall,
+            "exit_code": proc.returncode,
+        }
+    finally:
+        if not options.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = OptionParser(
+        usage="%prog [options] [-- collector options]",
+        description=__doc__.strip().split("\n\n")[0].replace("\n", " "),
+    )
+    parser.add_option(
+        "-n", "--hosts", dest="hosts", default="10,100,500",
+        help="comma separated numbers of simulated hosts to run with \
+(default=10,100,500)",
+    )
+    parser.add_option(
+        "", "--max-connections", dest="max_connections", type="int",
+        default=10,
+        help="passed to the collector (default=10)",
+    )
+    parser.add_option(
+        "", "--profile", dest="profile_file",
+        help="JSON file describing the simulated hosts, see standin.py; \
+the options below override it",
+    )
+    for key, value in sorted(DEFAULT_PROFILE.items()):
+        parser.add_option(
+            "", "--%s" % key.replace("_", "-"), dest=key, type="float",
+            help="(default=%s)" % value,
+        )
+    parser.add_option(
+        "", "--json", dest="json", action="store_true", default=False,
+        help="print the results as JSON",
+    )
+    parser.add_option(
+        "", "--keep", dest="keep", action="store_true", default=False,
+        help="keep the work directories, with the collector log and archive",
+    )
+    options, extra_args = parser.parse_args()
+
+    options.profile = dict(DEFAULT_PROFILE)
+    if options.profile_file:
+        with open(options.profile_file) as profile_file:
+            options.profile.update(json.load(profile_file))
+    for key in DEFAULT_PROFILE:
+        if getattr(options, key) is not None:
+            options.profile[key] = getattr(options, key)
+
+    results = []
+    if not options.json:
+        print(" ".join("%9s" % header for header in HEADERS))
+    for count in [int(n) for n in options.hosts.split(",")]:
+        result = run(count, options, extra_args)
+        results.append(result)
+        if not options.json:
+            print(" ".join(
+                "%9s" % (fmt % result[key]) for key, fmt in COLUMNS
+            ))
+            sys.stdout.flush()
+    if options.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
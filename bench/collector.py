@@ -0,0 +1,47 @@
+#!/usr/bin/python3
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Runs ovirt-log-collector with the hosts listed in the JSON file named by
+OLC_BENCH_INVENTORY in place of the engine API, and without requiring
+root. The file lists hosts as the inventory cache does:
+[data center, [cluster id, cluster name, gluster], address, spm, up].
+The caches are kept in OLC_BENCH_CACHE_DIR, if set.
+"""
+
+import json
+import os
+import runpy
+import sys
+
+from ovirt_log_collector import config
+from ovirt_log_collector.helper import hypervisors
+
+
+def get_all(*args, **kwargs):
+    tree = hypervisors.ENGINETree()
+    with open(os.environ["OLC_BENCH_INVENTORY"]) as inventory:
+        for host in json.load(inventory):
+            tree.add_sortable(*host)
+    return tree
+
+
+if __name__ == "__main__":
+    hypervisors.get_all = get_all
+    os.geteuid = lambda: 0
+    if os.environ.get("OLC_BENCH_CACHE_DIR"):
+        config.DEFAULT_CACHE_DIR = os.environ["OLC_BENCH_CACHE_DIR"]
+    sys.argv[0] = "ovirt-log-collector"
+    runpy.run_module("ovirt_log_collector", run_name="__main__")
@@ -0,0 +1,254 @@
+#!/usr/bin/python3
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Stand-in for ssh, scp and sos, run under those names by the benchmarks.
+
+The simulated hypervisors are described by the JSON profile named by
+OLC_BENCH_PROFILE, see DEFAULT_PROFILE; its "hosts" entry overrides the
+defaults for single hosts, by address.
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import signal
+import socket
+import sys
+import time
+
+
+DEFAULT_PROFILE = {
+    # Seconds to open a connection, saved by an ssh master
+    "latency": 0.005,
+    # Seconds a sosreport takes
+    "sos_duration": 1.0,
+    # Seconds the sosreport of the engine takes
+    "engine_sos_duration": 1.0,
+    # Bytes of each report
+    "report_size": 1 << 20,
+    # Bytes per second a report is sent at, 0 for no limit
+    "transfer_rate": 0,
+    # Fraction of the hosts whose sosreport fails
+    "failure_rate": 0.0,
+}
+
+CHUNK_SIZE = 1 << 20
+# Reports look like xz archives, as the real ones
+REPORT_MAGIC = b'\xfd7zXZ\x00'
+SOS_VERSION = "4.5.6"
+PLUGINS = ("logs", "ovirt", "vdsm")
+PLUGIN_OPTIONS = ("ovirt.sensitive_keys", "vdsm.dump-volume-chains")
+# KiB free in the sos temporary directory of the hosts
+FREE_SPACE = 50 << 20
+
+# ssh and scp options followed by a value
+VALUE_OPTIONS = ("-p", "-P", "-i", "-l", "-o")
+
+
+def load_profile(host):
+    profile = dict(DEFAULT_PROFILE)
+    path = os.environ.get("OLC_BENCH_PROFILE")
+    if path:
+        with open(path) as profile_file:
+            settings = json.load(profile_file)
+        hosts = settings.pop("hosts", {})
+        profile.update(settings)
+        profile.update(hosts.get(host, {}))
+    return profile
+
+
+def fails(host, profile):
+    """Whether host is one of the failure_rate hosts, always the same."""
+    digest = hashlib.sha256(host.encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "big") < profile["failure_rate"] * 2**32
+
+
+def report_chunks(host, size):
+    block = hashlib.shake_256(host.encode("utf-8")).digest(CHUNK_SIZE)
+    data = REPORT_MAGIC + block[len(REPORT_MAGIC):]
+    while size > 0:
+        yield data[:size]
+        size -= len(data)
+        data = block
+
+
+def report_path(host):
+    return "/var/tmp/sosreport-%s-bench.tar.xz" % host
+
+
+def parse_args(args):
+    """
+    Returns the options, as a list of (option, value), the destination and
+    the remaining arguments.
+    """
+    options = []
+    while args and args[0].startswith("-"):
+        option = args.pop(0)
+        value = None
+        if option in VALUE_OPTIONS:
+            value = args.pop(0)
+        elif option[:2] in VALUE_OPTIONS and len(option) > 2:
+            option, value = option[:2], option[2:]
+        options.append((option, value))
+    return options, args[0], args[1:]
+
+
+def list_plugins():
+    """Print the plugins and plugin options, as sos does."""
+    print("The following plugins are currently enabled:\n")
+    for plugin in PLUGINS:
+        print(" %-20s %s plugin" % (plugin, plugin))
+    print("\nThe following plugin options are available:\n")
+    for option in PLUGIN_OPTIONS:
+        print(" %-30s off  %s option" % (option, option))
+
+
+def probe(command, now):
+    print("== version\n%s" % SOS_VERSION)
+    # The plugins are cached for this version
+    if "'%s'" % SOS_VERSION in command:
+        print("== cached")
+    else:
+        print("== plugins")
+        list_plugins()
+    print("== space")
+    print("/dev/mapper/root %d %d %d 50%% /" % (
+        2 * FREE_SPACE, FREE_SPACE, FREE_SPACE
+    ))
+    print("== load\n%.2f 0.50 0.50 1/100 1000" % os.getloadavg()[0])
+    print("== date\n%s" % now)
+
+
+def connect(options, profile):
+    """Simulate opening a connection, unless an ssh master is up."""
+    for option, value in options:
+        if option == "-o" and value.startswith("ControlPath="):
+            if os.path.exists(value.split("=", 1)[1]):
+                return
+    time.sleep(profile["latency"])
+
+
+def send_report(host, profile, out):
+    started = time.monotonic()
+    sent = 0
+    for chunk in report_chunks(host, int(profile["report_size"])):
+        out.write(chunk)
+        sent += len(chunk)
+        if profile["transfer_rate"]:
+            delay = sent / profile["transfer_rate"] - (
+                time.monotonic() - started
+            )
+            if delay > 0:
+                time.sleep(delay)
+    out.flush()
+
+
+def ssh_master(control_path, profile):
+    time.sleep(profile["latency"])
+    master = socket.socket(socket.AF_UNIX)
+    master.bind(control_path)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        signal.pause()
+    finally:
+        os.unlink(control_path)
+
+
+def ssh(args):
+    options, destination, command = parse_args(args)
+    host = destination.split("@")[-1]
+    profile = load_profile(host)
+    settings = dict(
+        value.split("=", 1) for option, value in options
+        if option == "-o"
+    )
+    if settings.get("ControlMaster") == "yes":
+        return ssh_master(settings["ControlPath"], profile)
+    connect(options, profile)
+    command = " ".join(command)
+    now = datetime.datetime.now().astimezone().isoformat(timespec="seconds")
+
+    # The probe lists the plugins, the path of the report contains
+    # "sosreport"
+    if "== version" in command:
+        probe(command, now)
+    elif "/bin/cat " in command:
+        send_report(host, profile, sys.stdout.buffer)
+    elif "sos report" in command or "sosreport" in command:
+        time.sleep(profile["sos_duration"])
+        if fails(host, profile):
+            sys.stderr.write("sosreport failed on %s\n" % host)
+            return 1
+        checksum = hashlib.sha256()
+        for chunk in report_chunks(host, int(profile["report_size"])):
+            checksum.update(chunk)
+        print(
+            "Your sosreport has been generated and saved in:\n"
+            "  %s\n\n"
+            "The sha256sum is: %s" % (report_path(host), checksum.hexdigest())
+        )
+    elif "/usr/bin/find /var/log" in command:
+        for name in ("messages", "vdsm/vdsm.log", "libvirt/libvirtd.log"):
+            print("/var/log/%s\t%d\t%f" % (name, 1 << 20, time.time()))
+    elif "ls -lRZ" in command:
+        print("/etc:\n-rw-r--r--. root root system_u:object_r:etc_t:s0 x")
+    return 0
+
+
+def scp(args):
+    options, source, rest = parse_args(args)
+    host = source.split("@")[-1].split(":")[0]
+    profile = load_profile(host)
+    connect(options, profile)
+    with open(rest[0], "wb") as out:
+        send_report(host, profile, out)
+    return 0
+
+
+def sos(args):
+    """The local sos, run for the sosreport of the engine."""
+    profile = load_profile("localhost")
+    if "--list-plugins" in args:
+        list_plugins()
+        return 0
+    time.sleep(profile["engine_sos_duration"])
+    for arg in args:
+        if arg.startswith("--tmp-dir="):
+            report = os.path.join(
+                arg.split("=", 1)[1].strip("'"),
+                "sosreport-engine-bench"
+            )
+            os.makedirs(report)
+            with open(os.path.join(report, "version.txt"), "w") as out:
+                out.write("bench\n")
+    return 0
+
+
+def main():
+    program = os.path.basename(sys.argv[0])
+    if program == "ssh":
+        return ssh(sys.argv[1:])
+    if program == "scp":
+        return scp(sys.argv[1:])
+    if program in ("sos", "sosreport"):
+        return sos(sys.argv[1:])
+    sys.stderr.write("%s: unknown stand-in\n" % program)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
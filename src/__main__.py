@@ -17,6 +17,7 @@ from __future__ import absolute_import, print_function
 
 import sys
 import os
+import asyncio
 from optparse import OptionParser, OptionGroup, SUPPRESS_HELP
 import subprocess
 import shlex
@@ -33,6 +34,7 @@ import dateutil.tz as tz
 import errno
 import tempfile
 import textwrap
+import math
 import atexit
 import time
 import socket
@@ -40,7 +42,14 @@ import sos
 import stat
 import configparser
 import glob
-
+import hashlib
+import io
+import json
+import threading
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing
 from copy import copy
 from functools import partial
 
@@ -48,16 +57,48 @@ from functools import partial
 from ovirt_engine import configfile
 
 
+from .helper import archive
+from .helper import capabilities
+from .helper import checkpoint
+from .helper import concurrency
 from .helper import hypervisors
+from .helper import progress
+from .helper import tracing
 from ovirt_log_collector import config
 
 
 DEFAULT_SSH_USER = 'root'
+DEFAULT_SSH_BIN_DIR = '/usr/bin'
 DEFAULT_TIME_SHIFT_FILE = 'time_diff.txt'
+DEFAULT_MANIFEST_FILE = 'manifest.json'
+DEFAULT_INVENTORY_CACHE_FILE = 'inventory.json'
+DEFAULT_CAPABILITIES_CACHE_FILE = 'capabilities.json'
+DEFAULT_TRACE_FILE = 'trace.json'
+# Directory of local_tmp_dir where the PostgreSQL sosreport is created
+POSTGRES_SOS_TMP_DIR = 'postgresql'
+DEFAULT_CHECKPOINT_FILE = 'checkpoint.jsonl'
+# sos --since format
+SOS_SINCE_FORMAT = '%Y%m%d%H%M%S'
 PGPASS_FILE_ADMIN_LINE = "DB ADMIN credentials"
 DEFAULT_SCRATCH_DIR = None  # Will be initialized by __main__
 SSH_SERVER_ALIVE_INTERVAL = 600
+SSH_MASTER_STARTUP_TIMEOUT = 30
+# Seconds a timed out remote command is given after the local one is killed,
+# so it is reported as timed out, and then to exit after SIGTERM
+REMOTE_TIMEOUT_GRACE = 5
+REMOTE_KILL_AFTER = 10
+STREAM_CHUNK_SIZE = 1 << 20
+# Bytes of a streamed report synced to the disk at once, timing how long
+# the disk takes to write them
+STREAM_SYNC_SIZE = 8 << 20
+TRACE_CMD_LENGTH = 80
 MAX_WARN_HOSTS_COUNT = 10
+# Seconds the phases are given to stop once their programs are terminated
+PHASE_STOP_TIMEOUT = 10
+# Name resolutions run at once while matching hosts given with -H
+DNS_CONCURRENCY = 16
+# Free space below which a sosreport is likely to fail on a hypervisor
+SOS_TMP_MIN_FREE_SPACE = 1 << 30
 
 # {Logging system
 STREAM_LOG_FORMAT = '%(levelname)s: %(message)s'
@@ -90,6 +131,140 @@ class NoSosReportError(Exception):
     pass
 
 
+class HostTimeoutError(Exception):
+    pass
+
+
+class HostProbe(object):
+    """
+    What is known of a hypervisor before collecting from it, gathered by
+    a single command: its sos version, plugins and plugin options, the free
+    space in the sos temporary directory, its load average and time.
+    """
+
+    SOS_TMP_DIR = '/var/tmp'
+    # Each section is announced by a "== name" line
+    COMMAND = (
+        '%%(ssh_cmd)s "'
+        'VERSION=`/bin/rpm -q --qf \'%%%%{VERSION}\' sos`; '
+        '/bin/echo == version; '
+        '/bin/echo $VERSION; '
+        '%(plugins)s'
+        '/bin/echo == space; '
+        '/bin/df -Pk %(tmp_dir)s | /usr/bin/tail -n 1; '
+        '/bin/echo == load; '
+        '/bin/cat /proc/loadavg; '
+        '/bin/echo == date; '
+        '/bin/date --iso-8601=seconds"'
+    )
+    # The plugins are only listed if sos is not at the version they were
+    # cached for, otherwise a "== cached" section comes instead. Listing
+    # them loads every sos plugin.
+    PLUGINS = (
+        'if [ \\"$VERSION\\" = \'%(cached_version)s\' ]; then '
+        '/bin/echo == cached; '
+        'else '
+        '/bin/echo == plugins; '
+        '/usr/sbin/sos report --list-plugins 2>/dev/null || '
+        '/usr/sbin/sosreport --list-plugins 2>/dev/null; '
+        'fi; '
+    )
+
+    def __init__(self):
+        self.sos_version = None
+        self.plugins = set()
+        self.options = set()
+        # Whether the plugins were listed, rather than left to the cache
+        self.listed_plugins = False
+        self.free_space = None
+        self.load = None
+        self.time = None
+
+    @classmethod
+    def command(cls, cached_version=None, list_plugins=True):
+        """
+        Returns the probe command, listing the plugins if list_plugins,
+        unless sos is at cached_version.
+        """
+        plugins = ""
+        if list_plugins:
+            if not cached_version or not all(
+                c.isalnum() or c in "._-" for c in cached_version
+            ):
+                # Never an rpm version
+                cached_version = "-"
+            plugins = cls.PLUGINS % {"cached_version": cached_version}
+        return cls.COMMAND % {
+            "plugins": plugins,
+            "tmp_dir": cls.SOS_TMP_DIR,
+        }
+
+    @property
+    def version(self):
+        """
+        The (major, minor) sos version, None if sos is not installed.
+        """
+        try:
+            return tuple(int(n) for n in self.sos_version.split(".")[:2])
+        except (AttributeError, ValueError):
+            return None
+
+    @classmethod
+    def parse(cls, stdout):
+        probe = cls()
+        sections = {}
+        lines = None
+        for line in stdout.splitlines():
+            if line.startswith("== "):
+                lines = sections.setdefault(line[3:].strip(), [])
+            elif lines is not None and line.strip():
+                lines.append(line)
+
+        version = sections.get("version", [""])[0].strip()
+        if version and " " not in version:
+            # Otherwise rpm says sos is not installed
+            probe.sos_version = version
+
+        if "plugins" in sections:
+            probe.listed_plugins = True
+            probe.plugins, probe.options = capabilities.parse_plugins(
+                "\n".join(sections["plugins"])
+            )
+
+        try:
+            # Filesystem 1024-blocks Used Available Capacity Mounted on
+            probe.free_space = int(sections["space"][0].split()[3]) * 1024
+        except (KeyError, IndexError, ValueError):
+            logging.debug("probe: unexpected df output %r" % sections.get(
+                "space"
+            ))
+        try:
+            probe.load = [
+                float(n) for n in sections["load"][0].split()[:3]
+            ]
+        except (KeyError, IndexError, ValueError):
+            logging.debug("probe: unexpected loadavg %r" % sections.get(
+                "load"
+            ))
+        if sections.get("date"):
+            probe.time = sections["date"][0].strip()
+        return probe
+
+    def to_manifest(self):
+        time = None
+        try:
+            # The host local time, where later --incremental runs start from
+            time = dateutil.parser.parse(self.time).strftime(SOS_SINCE_FORMAT)
+        except (TypeError, ValueError, OverflowError):
+            logging.debug("probe: unexpected date %r" % self.time)
+        return {
+            "time": time,
+            "sos_version": self.sos_version,
+            "free_space": self.free_space,
+            "load": self.load,
+        }
+
+
 # Default DB connection params
 pg_user = 'postgres'
 pg_pass = None
@@ -246,24 +421,83 @@ class Caller(object):
     """
     Utility class for forking programs.
     """
+    # Programs forked by call() and stream() still running, from any thread
+    _running = set()
+    _running_lock = threading.Lock()
+    # Set by terminate_running, the programs forked after are terminated
+    _terminating = False
+
     def __init__(self, configuration):
         self.configuration = configuration
 
+    @classmethod
+    def terminate_running(cls):
+        """
+        Terminate the programs forked by call() and stream() still running,
+        whose threads won't wait for them, e.g. on user cancel.
+        """
+        with cls._running_lock:
+            cls._terminating = True
+            procs = list(cls._running)
+        for proc in procs:
+            cls._terminate(proc)
+
+    @staticmethod
+    def _terminate(proc):
+        try:
+            proc.terminate()
+        except ProcessLookupError:
+            pass
+
+    @classmethod
+    def _track(cls, proc):
+        with cls._running_lock:
+            cls._running.add(proc)
+            terminating = cls._terminating
+        if terminating:
+            cls._terminate(proc)
+
+    @classmethod
+    def _untrack(cls, proc):
+        with cls._running_lock:
+            cls._running.discard(proc)
+
     def prep(self, cmd):
         _cmd = cmd % self.configuration
         return shlex.split(_cmd)
 
-    def call(self, cmds, raise_on_error=True):
-        """Uses the configuration to fork a subprocess and run cmds."""
+    @staticmethod
+    def describe(cmd):
+        """Returns a short description of cmd for the trace. The template is
+        used, the command line may hold secrets."""
+        cmd = " ".join(cmd.split())
+        if len(cmd) > TRACE_CMD_LENGTH:
+            cmd = cmd[:TRACE_CMD_LENGTH - 3] + "..."
+        return cmd
+
+    def call(self, cmds, raise_on_error=True, env=None):
+        """Uses the configuration to fork a subprocess and run cmds.
+        @param env: environment of the subprocess, the one of this process
+            by default"""
         _cmds = self.prep(cmds)
         logging.debug("calling(%s)" % _cmds)
-        proc = subprocess.Popen(
-            _cmds,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        stdout, stderr = proc.communicate()
-        returncode = proc.returncode
+        with tracing.span("call", "command", cmd=self.describe(cmds)):
+            proc = subprocess.Popen(
+                _cmds,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                env=env
+            )
+            self._track(proc)
+            try:
+                stdout, stderr = proc.communicate()
+            finally:
+                self._untrack(proc)
+        return self.check(proc.returncode, stdout, stderr, raise_on_error)
+
+    def check(self, returncode, stdout, stderr, raise_on_error=True):
+        """Returns the decoded stdout of a program that exited with
+        returncode, or raises its stderr if it failed."""
         logging.debug("returncode(%s)" % returncode)
         logging.debug("STDOUT(%s)" % stdout)
         logging.debug("STDERR(%s)" % stderr)
@@ -278,6 +512,170 @@ class Caller(object):
                 # enough for debugging issues.
                 pass
 
+    def stream(self, cmds, fileobj):
+        """
+        Uses the configuration to fork a subprocess running cmds and writes
+        its stdout to fileobj as it is produced.
+        Returns the sha256 hex digest of the data written.
+        """
+        _cmds = self.prep(cmds)
+        logging.debug("streaming(%s)" % _cmds)
+        checksum = hashlib.sha256()
+        with tempfile.TemporaryFile() as stderr:
+            proc = subprocess.Popen(
+                _cmds,
+                stdout=subprocess.PIPE,
+                stderr=stderr
+            )
+            self._track(proc)
+            try:
+                for chunk in iter(
+                    partial(proc.stdout.read, STREAM_CHUNK_SIZE),
+                    b''
+                ):
+                    checksum.update(chunk)
+                    fileobj.write(chunk)
+            except BaseException:
+                proc.kill()
+                proc.wait()
+                raise
+            finally:
+                proc.stdout.close()
+                self._untrack(proc)
+            returncode = proc.wait()
+            stderr.seek(0)
+            errors = stderr.read()
+        logging.debug("returncode(%s)" % returncode)
+        logging.debug("STDERR(%s)" % errors)
+
+        if returncode != 0:
+            raise Exception(errors.decode("utf-8"))
+        return checksum.hexdigest()
+
+
+class AsyncCaller(Caller):
+    """
+    Caller forking programs as asyncio subprocesses, for use by coroutines.
+    The program is killed if the calling task is cancelled.
+    """
+
+    def __init__(self, configuration):
+        super(AsyncCaller, self).__init__(configuration)
+        # time.monotonic() after which the commands run over ssh are killed
+        # on the remote host too, None for no limit
+        self.deadline = None
+
+    def remote(self, cmds):
+        """
+        Returns the command line of cmds, with the remote command of an ssh
+        call, its last argument, run under timeout(1) if there is a
+        deadline: the local ssh client being killed does not stop it.
+        """
+        _cmds = self.prep(cmds)
+        if (
+            self.deadline is not None and
+            os.path.basename(_cmds[0]) == "ssh"
+        ):
+            seconds = int(math.ceil(self.deadline - time.monotonic()))
+            _cmds[-1] = "/usr/bin/timeout -k %d %d /bin/sh -c %s" % (
+                REMOTE_KILL_AFTER,
+                max(seconds, 0) + REMOTE_TIMEOUT_GRACE,
+                shlex.quote(_cmds[-1]),
+            )
+        return _cmds
+
+    @staticmethod
+    async def kill(proc):
+        if proc.returncode is None:
+            try:
+                proc.kill()
+            except ProcessLookupError:
+                pass
+            await proc.wait()
+
+    async def call(self, cmds, raise_on_error=True):
+        """Uses the configuration to fork a subprocess and run cmds."""
+        _cmds = self.remote(cmds)
+        logging.debug("calling(%s)" % _cmds)
+        with tracing.span(
+            "call",
+            "command",
+            track=self.configuration.get("hostname"),
+            cmd=self.describe(cmds),
+        ):
+            proc = await asyncio.create_subprocess_exec(
+                *_cmds,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE
+            )
+            try:
+                stdout, stderr = await proc.communicate()
+            except BaseException:
+                await self.kill(proc)
+                raise
+        return self.check(proc.returncode, stdout, stderr, raise_on_error)
+
+    async def stream(self, cmds, fileobj, monitors=(), buckets=()):
+        """
+        Uses the configuration to fork a subprocess running cmds and writes
+        its stdout to fileobj as it is produced.
+        Returns the sha256 hex digest of the data written.
+        @param monitors: objects whose transferred(fileobj, nbytes,
+            write_seconds) is called for each chunk written, with the time
+            taken to sync the file to the disk every STREAM_SYNC_SIZE bytes
+        @param buckets: concurrency.TokenBucket limiting the rate at which
+            stdout is read
+        """
+        _cmds = self.remote(cmds)
+        logging.debug("streaming(%s)" % _cmds)
+        checksum = hashlib.sha256()
+        try:
+            sync_fd = fileobj.fileno()
+        except (AttributeError, io.UnsupportedOperation):
+            sync_fd = None
+        unsynced = 0
+        loop = asyncio.get_event_loop()
+        with tempfile.TemporaryFile() as stderr:
+            proc = await asyncio.create_subprocess_exec(
+                *_cmds,
+                stdout=subprocess.PIPE,
+                stderr=stderr
+            )
+            try:
+                while True:
+                    chunk = await proc.stdout.read(STREAM_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    checksum.update(chunk)
+                    fileobj.write(chunk)
+                    unsynced += len(chunk)
+                    written = 0.0
+                    if sync_fd is not None and unsynced >= STREAM_SYNC_SIZE:
+                        # A write only copies to the page cache, a slow
+                        # disk shows when syncing
+                        started = time.monotonic()
+                        fileobj.flush()
+                        await loop.run_in_executor(None, os.fsync, sync_fd)
+                        written = time.monotonic() - started
+                        unsynced = 0
+                    for monitor in monitors:
+                        monitor.transferred(fileobj, len(chunk), written)
+                    if buckets:
+                        # Not reading throttles the sender through ssh
+                        await concurrency.throttle(buckets, len(chunk))
+            except BaseException:
+                await self.kill(proc)
+                raise
+            returncode = await proc.wait()
+            stderr.seek(0)
+            errors = stderr.read()
+        logging.debug("returncode(%s)" % returncode)
+        logging.debug("STDERR(%s)" % errors)
+
+        if returncode != 0:
+            raise Exception(errors.decode("utf-8"))
+        return checksum.hexdigest()
+
 
 class Configuration(dict):
     """This class is a dictionary subclass that knows how to read and """
@@ -534,6 +932,8 @@ class Configuration(dict):
 
 
 class CollectorBase(object):
+    caller_class = Caller
+
     def __init__(self,
                  hostname,
                  configuration=None,
@@ -544,7 +944,7 @@ class CollectorBase(object):
         else:
             self.configuration = {}
         self.prep()
-        self.caller = Caller(self.configuration)
+        self.caller = self.caller_class(self.configuration)
 
     def prep(self):
         self.configuration['ssh_cmd'] = self.format_ssh_command()
@@ -556,6 +956,80 @@ class CollectorBase(object):
     def get_ssh_user(self):
         return "%s@" % DEFAULT_SSH_USER
 
+    def get_control_path(self):
+        """
+        Returns the path of the socket used to share a single SSH connection
+        among all the commands run against this host, or None if connection
+        sharing is disabled.
+        """
+        control_dir = self.configuration.get("ssh_control_dir")
+        if not control_dir:
+            return None
+        # Unix socket paths are limited to ~100 chars, hostnames are not.
+        key = "%s%s:%s" % (
+            self.get_ssh_user(),
+            self.hostname,
+            self.configuration.get("ssh_port"),
+        )
+        return os.path.join(
+            control_dir,
+            hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+        )
+
+    async def open_ssh_master(self):
+        """
+        Start the master connection used by every further ssh and scp call
+        to this host. If it can't be started, each command falls back to
+        its own connection.
+        """
+        control_path = self.get_control_path()
+        if control_path is None:
+            return
+        cmd = self.caller.prep("%(ssh_cmd)s")
+        # The first obtained value wins for ssh options
+        cmd[1:1] = ["-oControlMaster=yes", "-N"]
+        logging.debug("starting ssh master(%s)" % cmd)
+        self._ssh_master = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        deadline = time.time() + SSH_MASTER_STARTUP_TIMEOUT
+        while not os.path.exists(control_path):
+            if (
+                self._ssh_master.returncode is not None or
+                time.time() > deadline
+            ):
+                logging.debug(
+                    "ssh master for %s not available, using a connection "
+                    "per command" % self.hostname
+                )
+                await self.close_ssh_master()
+                return
+            await asyncio.sleep(0.1)
+
+    async def close_ssh_master(self):
+        master = getattr(self, "_ssh_master", None)
+        if master is None:
+            return
+        self._ssh_master = None
+        if master.returncode is None:
+            master.terminate()
+            try:
+                await asyncio.wait_for(
+                    master.wait(),
+                    SSH_MASTER_STARTUP_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                await AsyncCaller.kill(master)
+        logging.debug(
+            "ssh master for %s exited(%s)" % (
+                self.hostname,
+                master.returncode,
+            )
+        )
+
     def parse_sosreport_stdout(self, stdout):
         def reportFinder(line):
             if fnmatch.fnmatch(line, '*sosreport-*tar*'):
@@ -607,30 +1081,46 @@ class CollectorBase(object):
             )
 
     def format_ssh_command(self, cmd="ssh"):
-        cmd = "/usr/bin/%s " % cmd
+        program = cmd
+        cmd = "%s " % os.path.join(
+            self.configuration.get("ssh_bin_dir") or DEFAULT_SSH_BIN_DIR,
+            program
+        )
 
         # disable reading from stdin
-        if cmd.startswith("/usr/bin/ssh"):
+        if program == "ssh":
             cmd += "-n "
 
         if "ssh_port" in self.configuration:
-            port_flag = "-p" if cmd.startswith("/usr/bin/ssh") else "-P"
+            port_flag = "-p" if program == "ssh" else "-P"
             cmd += port_flag + " %(ssh_port)s " % self.configuration
 
         if self.get_key_file():
             cmd += "-i %s " % self.get_key_file()
 
+        if (
+            program == "scp" and
+            self.configuration.get("scp_bandwidth_limit")
+        ):
+            cmd += "-l %(scp_bandwidth_limit)d " % self.configuration
+
         # ignore host key checking
         cmd += "-oStrictHostKeyChecking=no "
         # keep alive the connection
         cmd += '-oServerAliveInterval=%d ' % SSH_SERVER_ALIVE_INTERVAL
 
+        control_path = self.get_control_path()
+        if control_path:
+            # share a single connection for all the commands to this host
+            cmd += "-oControlMaster=auto -oControlPath=%s " % control_path
+
         cmd += self.get_ssh_user()
 
         return cmd + "%s" % self.hostname
 
 
 class HyperVisorData(CollectorBase):
+    caller_class = AsyncCaller
     TIME_DRIFT_FORMAT = "%-17s : %-33s : %-33s : %-35s"
     TIME_DRIFT_HEADER = TIME_DRIFT_FORMAT % (
         'Node',
@@ -642,19 +1132,65 @@ class HyperVisorData(CollectorBase):
     def __init__(self,
                  hostname,
                  configuration=None,
-                 semaphore=None,
                  queue=None,
                  gluster_enabled=False,
                  time_diff_only=False,
                  dump_volume_chains=False,
+                 manifest=None,
+                 list_logs=False,
+                 since=None,
+                 monitor=None,
+                 buckets=None,
+                 host_progress=None,
+                 checkpoint=None,
+                 capabilities=None,
                  **kwargs):
+        """
+        @param manifest: dict where the host manifest entry is recorded
+        @param list_logs: whether to record the log files of the host in its
+            manifest entry, see list_logs()
+        @param since: only collect logs modified after this host local time,
+            in SOS_SINCE_FORMAT
+        @param monitor: optional object told about the report transfer, see
+            AsyncCaller.stream
+        @param buckets: concurrency.TokenBucket shared with other hosts to
+            limit the report transfer rate
+        @param host_progress: progress.HostProgress updated as the
+            collection goes
+        @param checkpoint: checkpoint.Checkpoint where the host is recorded
+            once collected
+        @param capabilities: capabilities.Cache of the host plugins, used
+            instead of listing them when its sos version did not change
+        """
         super(HyperVisorData, self).__init__(hostname, configuration)
-        self.sos_version = sos.__version__.replace('.', '')
-        self.semaphore = semaphore
+        self.capabilities = capabilities
         self.queue = queue
         self.gluster_enabled = gluster_enabled
         self.time_diff_only = time_diff_only
         self.dump_volume_chains = dump_volume_chains
+        self.manifest = manifest
+        self.list_logs_enabled = list_logs
+        self.since = since
+        if host_progress is None:
+            host_progress = progress.HostProgress(hostname)
+        self.progress = host_progress
+        self.monitors = [self.progress]
+        if monitor is not None:
+            self.monitors.append(monitor)
+        self.buckets = list(buckets or ())
+        if self.configuration.get("host_bandwidth_limit"):
+            self.buckets.append(
+                concurrency.TokenBucket(
+                    self.configuration["host_bandwidth_limit"] * 1024
+                )
+            )
+        self.checkpoint = checkpoint
+        self.timed_out = False
+        self.time_diff = None
+        # HostProbe of the host, once probed
+        self.probed = None
+        # Task running probe(), if started before collect()
+        self.probing = None
 
     def prep(self):
         self.configuration["hostname"] = self.hostname
@@ -751,6 +1287,7 @@ class HyperVisorData(CollectorBase):
             )
 
             self.queue.append(tmp)
+            self.time_diff = tmp
         else:
             tmp = self.TIME_DRIFT_FORMAT % (
                 "%(hostname)s " % self.configuration,
@@ -759,138 +1296,363 @@ class HyperVisorData(CollectorBase):
                 "-%s" % (l_time - h_time)
             )
             self.queue.append(tmp)
+            self.time_diff = tmp
 
-    def sosreport(self):
-        # Add gluster to the list of sosreports required if gluster is enabled
-        if self.gluster_enabled:
-            logging.info(
-                "Gluster logs will be collected from %s" % self.hostname
+    async def probe(self):
+        """
+        Gather the HostProbe of the host, for collect() and sosreport(), in
+        a single call, and compute its clock drift.
+        """
+        # Only the plugin options of the host dumping the volume chains
+        # are used
+        list_plugins = self.dump_volume_chains and not self.time_diff_only
+        cached_version = None
+        if list_plugins and self.capabilities is not None:
+            cached_version = self.capabilities.version(self.hostname)
+        # The probe may still run when the collection starts, it has its
+        # own deadline
+        caller = self.caller_class(self.configuration)
+        stdout = await self.step(
+            "probe",
+            caller.call(HostProbe.command(cached_version, list_plugins)),
+            caller=caller,
+        )
+        self.probed = HostProbe.parse(stdout)
+        if (
+            list_plugins and
+            self.capabilities is not None and
+            self.probed.sos_version
+        ):
+            if self.probed.listed_plugins:
+                if self.probed.plugins:
+                    self.capabilities.put(
+                        self.hostname,
+                        self.probed.sos_version,
+                        self.probed.plugins,
+                        self.probed.options,
+                    )
+            else:
+                cached = self.capabilities.get(
+                    self.hostname,
+                    self.probed.sos_version
+                )
+                if cached is not None:
+                    self.probed.plugins, self.probed.options = cached
+        logging.debug(
+            "host <%s> sos %s, %s bytes free in %s, load %s" % (
+                self.hostname,
+                self.probed.sos_version,
+                self.probed.free_space,
+                HostProbe.SOS_TMP_DIR,
+                self.probed.load,
             )
-            self.configuration['reports'] += ",gluster"
+        )
+        if (
+            not self.time_diff_only and
+            self.probed.free_space is not None and
+            self.probed.free_space < SOS_TMP_MIN_FREE_SPACE
+        ):
+            logging.warning(
+                "Only %d MiB free in %s on %s, its sosreport may fail" % (
+                    self.probed.free_space >> 20,
+                    HostProbe.SOS_TMP_DIR,
+                    self.hostname,
+                )
+            )
+        try:
+            self.get_time_diff(self.probed.time or "")
+        except ValueError as e:
+            logging.debug("get_time_diff: " + str(e))
 
-        cmd = """%(ssh_cmd)s "
-VERSION=`/bin/rpm -q --qf '[%%{{VERSION}}]' \
-    sos | /bin/sed 's/\\.//' | /bin/sed 's/\\..//'`;
-if [ "$VERSION" -ge "40" ]; then
-    /usr/sbin/sos report {option} {log_size} {dump_volume_chains} --batch \
-        {all_logs} -o {logs}%(reports)s,%(reports36)s
-elif [ "$VERSION" -ge "36" ]; then
-    /usr/sbin/sosreport {option} {log_size} {dump_volume_chains} --batch \
-        {all_logs} -o {logs}%(reports)s,%(reports36)s
-elif [ "$VERSION" -ge "35" ]; then
-    /usr/sbin/sosreport {option} {log_size} {dump_volume_chains} --batch \
-        {all_logs} -o {logs}%(reports)s,%(reports35)s
-elif [ "$VERSION" -ge "34" ]; then
-    /usr/sbin/sosreport {option} {log_size} --batch {all_logs} \
-        -o {logs}%(reports)s,%(reports34)s
-elif [ "$VERSION" -ge "33" ]; then
-    /usr/sbin/sosreport {option} {log_size} --batch {all_logs} \
-        -o {logs}%(reports)s,%(reports33)s
-elif [ "$VERSION" -ge "32" ]; then
-    /usr/sbin/sosreport {option} {log_size} --batch {all_logs} \
-        -o {logs}%(reports)s,%(reports32)s
-elif [ "$VERSION" -ge "30" ]; then
-    /usr/sbin/sosreport {option} {log_size} --batch -k logs.all_logs=True \
-        -o {logs}%(reports)s,%(reports3)s
-elif [ "$VERSION" -ge "22" ]; then
-    /usr/sbin/sosreport {option} {log_size} --batch -k general.all_logs=True \
-        -o general,%(reports)s
-elif [ "$VERSION" -ge "17" ]; then
-    /usr/sbin/sosreport {option} {log_size} --no-progressbar -k
-        general.all_logs=True -o %(bc_reports)s
-else
-    /bin/echo "No valid version of sosreport found." 1>&2
-    exit 1
-fi
-"
+    def sosreport_command(self):
         """
+        Returns the sosreport command suited to the sos version and plugin
+        options probed on the host.
+        """
+        version = self.probed.version
+        if version is None or version < (1, 7):
+            raise Exception("No valid version of sosreport found.")
 
+        if version >= (4, 0):
+            args = ["/usr/sbin/sos", "report"]
+        else:
+            args = ["/usr/sbin/sosreport"]
         if self.configuration.get("ticket_number"):
-            cmd = partial(cmd.format, option='--ticket-number={number}'.format(
-                number=self.configuration.get("ticket_number")
-            ))
+            args.append(
+                "--ticket-number=%s" % self.configuration["ticket_number"]
+            )
+        log_size = self.configuration.get("log_size")
+        if log_size:
+            args.append("--log-size=%s" % log_size)
+
+        if version < (2, 2):
+            args += [
+                "--no-progressbar",
+                "-k", "general.all_logs=True",
+                "-o", "%(bc_reports)s",
+            ]
+        elif version < (3, 0):
+            args += [
+                "--batch",
+                "-k", "general.all_logs=True",
+                "-o", "general,%(reports)s",
+            ]
         else:
-            cmd = partial(cmd.format, option='')
-
-        dump_chains_option = ""
-        if self.dump_volume_chains:
-            if self.sos_version >= '40':
-                plugins = self.caller.call(
-                    "%(ssh_cmd)s sos report --list-plugins"
-                )
-            else:
-                plugins = self.caller.call(
-                    "%(ssh_cmd)s sosreport --list-plugins"
+            args.append("--batch")
+            if version >= (3, 5) and self.dump_volume_chains:
+                if "vdsm.dump-volume-chains" in self.probed.options:
+                    args += ["-k", "vdsm.dump-volume-chains"]
+                else:
+                    logging.warning(
+                        "Host %r sosreport does not support option "
+                        "vdsm.dump-volume-chains", self.hostname
+                    )
+            if version < (3, 2):
+                args += ["-k", "logs.all_logs=True"]
+            elif not log_size:
+                args.append("--all-logs")
+            if version >= (4, 0) and self.since:
+                # Older sos versions don't support it and collect everything
+                args.append("--since=%s" % self.since)
+            reports = next(
+                name for minimum, name in (
+                    ((3, 6), "reports36"),
+                    ((3, 5), "reports35"),
+                    ((3, 4), "reports34"),
+                    ((3, 3), "reports33"),
+                    ((3, 2), "reports32"),
+                    ((3, 0), "reports3"),
                 )
-            if 'vdsm.dump-volume-chains' in plugins:
-                dump_chains_option = '-k vdsm.dump-volume-chains'
-            else:
-                logging.warning("Host %r sosreport does not support option "
-                                "vdsm.dump-volume-chains", self.hostname)
-        cmd = partial(cmd, dump_volume_chains=dump_chains_option)
+                if version >= minimum
+            )
+            logs = "logs," if not log_size or log_size >= 100 else ""
+            args += ["-o", "%s%%(reports)s,%%(%s)s" % (logs, reports)]
 
-        if self.configuration.get('log_size'):
-            if self.configuration.get('log_size') >= 100:
-                logs = 'logs,'
-            else:
-                logs = ''
-            cmd = cmd(
-                log_size='--log-size={size}'.format(
-                    size=self.configuration.get('log_size')
-                ),
-                all_logs='',
-                logs=logs,
+        return '%%(ssh_cmd)s "%s"' % " ".join(args)
+
+    async def sosreport(self):
+        # Add gluster to the list of sosreports required if gluster is enabled
+        if self.gluster_enabled:
+            logging.info(
+                "Gluster logs will be collected from %s" % self.hostname
             )
-        else:
-            cmd = cmd(log_size="", all_logs='--all-logs', logs='logs,')
+            self.configuration['reports'] += ",gluster"
 
-        return self.caller.call(cmd)
+        return await self.caller.call(self.sosreport_command())
 
-    def run(self):
+    async def list_logs(self):
+        """
+        Record in the manifest the path, size and mtime of every file under
+        /var/log, before running the sosreport.
+        """
+        stdout = await self.caller.call(
+            '%(ssh_cmd)s "/usr/bin/find /var/log -xdev -type f '
+            '-printf \'%%p\\\\t%%s\\\\t%%T@\\\\n\' 2>/dev/null; /bin/true"'
+        )
+        files = []
+        for line in stdout.splitlines():
+            try:
+                path, size, mtime = line.rsplit("\t", 2)
+                files.append([path, int(size), float(mtime)])
+            except ValueError:
+                logging.debug("list_logs: unexpected line %r" % line)
+        self.manifest.setdefault(self.hostname, {})["files"] = files
 
-        try:
-            logging.info(
-                "collecting information from %(hostname)s" % self.configuration
+    async def stream_sosreport(self):
+        """
+        Stream the host sosreport straight into hypervisor_dir over the
+        ssh connection and remove it from the host, in a single call.
+        """
+        archive_path = os.path.join(
+            self.configuration["hypervisor_dir"],
+            self.configuration["archive_name"]
+        )
+        with open(archive_path, "wb") as report:
+            checksum = await self.caller.stream(
+                '%(ssh_cmd)s "/bin/cat %(path)s && /bin/rm -f %(path)s*"',
+                report,
+                monitors=self.monitors,
+                buckets=self.buckets
             )
-            if not self.time_diff_only:
-                stdout = self.sosreport()
-                self.parse_sosreport_stdout(stdout)
-                self.configuration["hypervisor_dir"] = os.path.join(
-                    self.configuration.get("local_scratch_dir"),
-                    self.configuration.get("hostname")
+        expected = self.configuration.get("checksum")
+        if expected and expected.strip() != checksum:
+            raise Exception(
+                "Checksum mismatch for %s: expected %s, got %s" % (
+                    archive_path,
+                    expected.strip(),
+                    checksum,
                 )
-                os.mkdir(self.configuration["hypervisor_dir"])
-                self.configuration['archive_name'] = "%s-%s" % (
-                    self.configuration.get("hostname"),
-                    os.path.basename(self.configuration.get("path"))
+            )
+        self.configuration["checksum"] = checksum
+
+    async def step(self, name, coro, caller=None):
+        """
+        Await coro, running the remote step name with caller, self.caller by
+        default, for at most the <name>_timeout configured. On timeout its
+        command is killed, on the host too, and HostTimeoutError is raised.
+        """
+        if caller is None:
+            caller = self.caller
+        timeout = self.configuration.get("%s_timeout" % name) or None
+        previous = caller.deadline
+        if timeout is not None:
+            caller.deadline = time.monotonic() + timeout
+            if previous is not None:
+                caller.deadline = min(previous, caller.deadline)
+        self.progress.set_phase(name)
+        with tracing.span(name, "hypervisor", track=self.hostname):
+            try:
+                return await asyncio.wait_for(coro, timeout)
+            except asyncio.TimeoutError:
+                raise HostTimeoutError(
+                    "%s did not finish within %s seconds" % (name, timeout)
                 )
+            finally:
+                caller.deadline = previous
+
+    async def transfer_sosreport(self):
+        if self.configuration.get("transfer_mode") == "scp":
+            await self.caller.call(
+                '%(scp_cmd)s:%(path)s '
+                '%(hypervisor_dir)s/%(archive_name)s'
+            )
+            await self.caller.call('%(ssh_cmd)s "/bin/rm %(path)s*"')
+        else:
+            await self.stream_sosreport()
+
+    async def collect(self):
+        if self.probing is None:
+            self.probing = asyncio.ensure_future(self.probe())
+        await self.probing
+        if not self.time_diff_only:
+            self.progress.set_phase("connecting")
+            with tracing.span(
+                "connecting",
+                "hypervisor",
+                track=self.hostname,
+            ):
+                await self.open_ssh_master()
+            if self.manifest is not None:
+                self.manifest[self.hostname] = self.probed.to_manifest()
+                if self.list_logs_enabled:
+                    try:
+                        await self.step("listing", self.list_logs())
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        logging.warning(
+                            "Cannot list the logs of %s: %s" % (
+                                self.hostname,
+                                e,
+                            )
+                        )
+            stdout = await self.step("sosreport", self.sosreport())
+            self.parse_sosreport_stdout(stdout)
+            self.configuration["hypervisor_dir"] = os.path.join(
+                self.configuration.get("local_scratch_dir"),
+                self.configuration.get("hostname")
+            )
+            os.mkdir(self.configuration["hypervisor_dir"])
+            self.configuration['archive_name'] = "%s-%s" % (
+                self.configuration.get("hostname"),
+                os.path.basename(self.configuration.get("path"))
+            )
+            await self.step("transfer", self.transfer_sosreport())
+            if self.manifest is not None:
+                self.manifest[self.hostname].update({
+                    "report": self.configuration["archive_name"],
+                    "sha256": self.configuration.get("checksum"),
+                })
+            stdout = await self.step(
+                "listing",
                 self.caller.call(
-                    '%(scp_cmd)s:%(path)s %(hypervisor_dir)s/%(archive_name)s'
-                )
-                self.caller.call('%(ssh_cmd)s "/bin/rm %(path)s*"')
-                stdout = self.caller.call(
                     '%(ssh_cmd)s "/bin/ls -lRZ /etc /var /rhev"',
                     raise_on_error=False
                 )
-                self.configuration['selinux_dir'] = os.path.join(
-                    self.configuration.get('hypervisor_dir'),
-                    'selinux',
-                )
-                os.mkdir(self.configuration['selinux_dir'])
-                with open(
+            )
+            self.configuration['selinux_dir'] = os.path.join(
+                self.configuration.get('hypervisor_dir'),
+                'selinux',
+            )
+            os.mkdir(self.configuration['selinux_dir'])
+            with open(
+                os.path.join(
+                    self.configuration['selinux_dir'],
+                    'ls_-lRZ_etc_var_rhev',
+                ),
+                'w',
+            ) as f:
+                f.write(stdout)
+
+    def save_checkpoint(self):
+        base = self.configuration["local_working_dir"]
+        artifacts = []
+        if not self.time_diff_only:
+            artifacts = [
+                checkpoint.artifact(
+                    base,
+                    self.configuration["hypervisor_dir"]
+                ),
+                checkpoint.artifact(
+                    base,
                     os.path.join(
-                        self.configuration['selinux_dir'],
-                        'ls_-lRZ_etc_var_rhev',
+                        self.configuration["hypervisor_dir"],
+                        self.configuration["archive_name"]
                     ),
-                    'w',
-                ) as f:
-                    f.write(stdout)
+                    self.configuration.get("checksum"),
+                ),
+            ]
+        try:
+            self.checkpoint.host_done(
+                self.hostname,
+                artifacts,
+                manifest=(
+                    self.manifest.get(self.hostname)
+                    if self.manifest is not None
+                    else None
+                ),
+                time_diff=self.time_diff,
+            )
+        except EnvironmentError as e:
+            logging.warning(
+                "Cannot checkpoint %s, it will be collected again if the "
+                "collection is resumed: %s" % (self.hostname, e)
+            )
 
-            stdout = self.caller.call('%(ssh_cmd)s "date --iso-8601=seconds"')
+    async def run(self):
+        timeout = self.configuration.get("host_timeout") or None
+        self.progress.start()
+        state = progress.FAILED
+        try:
+            logging.info(
+                "collecting information from %(hostname)s" % self.configuration
+            )
+            if timeout is not None:
+                self.caller.deadline = time.monotonic() + timeout
             try:
-                self.get_time_diff(stdout)
-            except ValueError as e:
-                logging.debug("get_time_diff: " + str(e))
+                await asyncio.wait_for(self.collect(), timeout)
+            except asyncio.TimeoutError:
+                raise HostTimeoutError(
+                    "collection did not finish within %s seconds" % timeout
+                )
+            finally:
+                self.caller.deadline = None
+            state = progress.DONE
+        except asyncio.CancelledError:
+            # Not a failure of this host, the whole collection is stopping
+            raise
+        except HostTimeoutError as e:
+            ExitCodes.exit_code = ExitCodes.WARN
+            self.timed_out = True
+            state = progress.TIMED_OUT
+            logging.error(
+                "Timed out collecting logs from: %s; %s" % (
+                    self.configuration.get("hostname"),
+                    e
+                )
+            )
+            if self.manifest is not None:
+                self.manifest.setdefault(self.hostname, {})["timed_out"] = True
         except NoSosReportError as s:
             ExitCodes.exit_code = ExitCodes.CRITICAL
             logging.error(
@@ -913,8 +1675,10 @@ fi
             )
             multilog(logging.debug, pprint.pformat(self.configuration))
         finally:
-            if self.semaphore:
-                self.semaphore.release()
+            await self.close_ssh_master()
+        self.progress.finish(state)
+        if state == progress.DONE and self.checkpoint is not None:
+            self.save_checkpoint()
 
         logging.info(
             "finished collecting information from %(hostname)s" % (
@@ -924,13 +1688,15 @@ fi
 
 
 class ENGINEData(CollectorBase):
-    def __init__(self, hostname, configuration=None, **kwargs):
+    def __init__(self, hostname, configuration=None, capabilities=None,
+                 **kwargs):
+        """
+        @param capabilities: capabilities.Cache of the local sos plugins,
+            used instead of listing them when sos did not change
+        """
         super(ENGINEData, self).__init__(hostname, configuration)
         self.sos_version = sos.__version__.replace('.', '')
-        if self.sos_version >= '40':
-            self._plugins = self.caller.call('sos report --list-plugins')
-        else:
-            self._plugins = self.caller.call('sosreport --list-plugins')
+        self._plugins = self.get_plugins(capabilities)
         if 'ovirt.sensitive_keys' in self._plugins:
             self._engine_plugin = 'ovirt'
         elif 'ovirt-engine.sensitive_keys' in self._plugins:
@@ -942,6 +1708,25 @@ class ENGINEData(CollectorBase):
             self._engine_plugin = 'ovirt'
         self.dwh_prep()
 
+    def get_plugins(self, cache=None):
+        """
+        Returns the set of the local sos plugins and plugin options.
+        """
+        cached = None
+        if cache is not None:
+            cached = cache.get(self.hostname, sos.__version__)
+        if cached is not None:
+            plugins, options = cached
+        else:
+            if self.sos_version >= '40':
+                output = self.caller.call('sos report --list-plugins')
+            else:
+                output = self.caller.call('sosreport --list-plugins')
+            plugins, options = capabilities.parse_plugins(output)
+            if cache is not None and plugins:
+                cache.put(self.hostname, sos.__version__, plugins, options)
+        return plugins | options
+
     def prep(self):
         super(ENGINEData, self).prep()
         engine_service_config = configfile.ConfigFile([
@@ -1017,6 +1802,9 @@ class ENGINEData(CollectorBase):
             else:
                 opts.append("--all-logs")
 
+        if self.configuration.get("sos_since"):
+            opts.append("--since=%s" % self.configuration.get("sos_since"))
+
         if self.configuration.get("upload"):
             opts.append("--upload=%s" % self.configuration.get("upload"))
         return " ".join(opts)
@@ -1142,6 +1930,25 @@ class PostgresData(CollectorBase):
             return "%s@" % DEFAULT_SSH_USER
 
     def sosreport(self):
+        """
+        Run the sosreport in a directory of its own, out of the archived
+        tree, so an interrupted one leaves nothing there, then move its
+        report into the scratch directory.
+        """
+        sos_tmp_dir = os.path.join(
+            self.configuration["local_tmp_dir"],
+            POSTGRES_SOS_TMP_DIR
+        )
+        # Left by an interrupted collection
+        shutil.rmtree(sos_tmp_dir, ignore_errors=True)
+        os.mkdir(sos_tmp_dir, 0o700)
+        self.configuration["sos_tmp_dir"] = sos_tmp_dir
+        try:
+            self._sosreport()
+        finally:
+            shutil.rmtree(sos_tmp_dir, ignore_errors=True)
+
+    def _sosreport(self):
         opt = ""
         if self.configuration.get("ticket_number"):
             opt += '--ticket-number=%(ticket_number)s '
@@ -1161,28 +1968,36 @@ class PostgresData(CollectorBase):
             ).format(
                 plugin=self._postgres_plugin,
             )
-            os.putenv('PGPASSWORD', str(self.configuration.get('pg_pass')))
+            # Only for sos, the other phases run meanwhile
+            env = dict(
+                os.environ,
+                PGPASSWORD=str(self.configuration.get('pg_pass')),
+            )
             if self.sos_version >= '40':
                 sos_cmd = 'sos report'
             else:
                 sos_cmd = 'sosreport'
             cmdline = (
                 '/usr/sbin/{sos_cmd} --batch -o {plugin} '
-                '--tmp-dir=%(local_scratch_dir)s ' + opt
+                '--tmp-dir=%(sos_tmp_dir)s ' + opt
             ).format(
                 plugin=self._postgres_plugin,
                 sos_cmd=sos_cmd,
             )
-            stdout = self.caller.call(cmdline)
+            stdout = self.caller.call(cmdline, env=env)
             self.parse_sosreport_stdout(stdout)
 
             # Prepend postgresql- to the extension file that is produced by SOS
             # so that it is easy to distinguish from the other N reports
             # that are all related to hypervisors.
 
+            report = os.path.join(
+                self.configuration["sos_tmp_dir"],
+                self.configuration["filename"]
+            )
             # Files extension output for FIPS mode
-            md5_file = "%s.md5" % self.configuration["path"]
-            sha256_file = "%s.sha256" % self.configuration["path"]
+            md5_file = "%s.md5" % report
+            sha256_file = "%s.sha256" % report
 
             # FIPS mode disabled
             if os.path.exists(md5_file):
@@ -1203,7 +2018,7 @@ class PostgresData(CollectorBase):
         # that are all related to hypervisors.
         os.rename(
             os.path.join(
-                self.configuration["local_scratch_dir"],
+                self.configuration["sos_tmp_dir"],
                 self.configuration["filename"]
             ),
             os.path.join(
@@ -1219,23 +2034,113 @@ class LogCollector(object):
         self.conf = configuration
         if self.conf.command is None:
             raise Exception("No command specified.")
+        self.inventory = hypervisors.ENGINETree()
+        # name -> address, or None if it can't be resolved, for this run
+        self._addresses = {}
+        self.checkpoint = None
+        # The capabilities.Cache shared by the phases, see _load_capabilities
+        self._capabilities = None
+        self._capabilities_lock = threading.Lock()
+        self.time_diff_queue = deque()
+        self.base_manifest = None
+        if self.conf.get("incremental"):
+            self.base_manifest = self.load_manifest(self.conf["incremental"])
+        self.manifest = {
+            "created": datetime.datetime.now(tz=tz.tzlocal()).isoformat(),
+            "base": None,
+            "engine": {},
+            "hosts": {},
+        }
+        if self.base_manifest:
+            self.manifest["base"] = {
+                "archive": self.base_manifest.get("archive"),
+                "sha256": self.base_manifest.get("sha256"),
+            }
 
-    def archive(self):
+    @staticmethod
+    def load_manifest(path):
+        try:
+            with open(path) as manifest:
+                return json.load(manifest)
+        except (IOError, ValueError) as e:
+            raise Exception(
+                "Cannot load the manifest %s: %s" % (path, e)
+            )
+
+    @staticmethod
+    def _base_time(name, entry):
         """
-        Create a single tarball with collected data from engine, postgresql
-        and all hypervisors.
+        Returns the time of name in the base manifest, where an incremental
+        collection starts from, or None to collect all its logs when the
+        base collection did not complete for it.
         """
-        logging.info(_('Creating compressed archive...'))
-
-        report_file_ext = 'bz2'
-        compressor = 'bzip2'
-        caller = Caller({})
-        try:
-            caller.call('xz --version')
-            report_file_ext = 'xz'
-            compressor = 'xz'
-        except Exception:
-            logging.debug('xz compression not available')
+        if not entry:
+            return None
+        if entry.get("report") and not entry.get("timed_out"):
+            return entry.get("time")
+        logging.warning(
+            _(
+                'The base collection of {name} did not complete, all its '
+                'logs are collected'
+            ).format(
+                name=name,
+            )
+        )
+        return None
+
+    def write_manifest(self):
+        """
+        Write the manifest of this collection into the scratch dir, logging
+        how many logs changed on each host since the base collection.
+        """
+        base_hosts = (self.base_manifest or {}).get("hosts", {})
+        for host, entry in self.manifest["hosts"].items():
+            if "files" not in base_hosts.get(host, {}) or "files" not in entry:
+                continue
+            known = dict(
+                (path, size)
+                for path, size, mtime in base_hosts[host].get("files", [])
+            )
+            changed = [
+                path for path, size, mtime in entry.get("files", [])
+                if path not in known or size > known[path]
+            ]
+            entry["changed"] = changed
+            logging.info(
+                "%s: %d new or grown log files since %s" % (
+                    host,
+                    len(changed),
+                    base_hosts[host].get("time"),
+                )
+            )
+        with open(
+            os.path.join(
+                self.conf["local_scratch_dir"],
+                DEFAULT_MANIFEST_FILE
+            ),
+            "w"
+        ) as manifest:
+            json.dump(self.manifest, manifest)
+
+    def archive(self):
+        """
+        Create a single tarball with collected data from engine, postgresql
+        and all hypervisors.
+        """
+        logging.info(_('Creating compressed archive...'))
+
+        try:
+            compressor = archive.get_compressor(
+                self.conf.get("compressor") or "auto",
+                int(self.conf.get("compress_threads") or 0),
+            )
+        except ValueError as e:
+            ExitCodes.exit_code = ExitCodes.WARN
+            logging.warning(
+                _('{error}, using the default compressor').format(error=e)
+            )
+            compressor = archive.get_compressor()
+        report_file_ext = compressor.extension
 
         if not os.path.exists(self.conf["output"]):
             os.makedirs(self.conf["output"])
@@ -1260,32 +2165,37 @@ class LogCollector(object):
                 )
             )
 
-        config = {
-            'report': os.path.splitext(self.conf['path'])[0],
-            'compressed_report': self.conf['path'],
-            'compressor': compressor,
-            'directory': self.conf["local_tmp_dir"],
-            'rname': os.path.basename(self.conf['path']).split('.')[0],
-        }
-        caller.configuration = config
-        shutil.move(
-            os.path.join(
-                self.conf["local_tmp_dir"],
-                'working'
-            ),
-            os.path.join(
-                self.conf["local_tmp_dir"],
-                config["rname"]
-            ),
+        # The archive can only hold the spans recorded before it is created,
+        # the complete trace is written next to it
+        tracing.write(
+            os.path.join(self.conf["local_scratch_dir"], DEFAULT_TRACE_FILE)
         )
-        caller.call("tar -cf '%(report)s' -C '%(directory)s' '%(rname)s'")
-        shutil.rmtree(self.conf["local_tmp_dir"])
-        caller.call("%(compressor)s -1 '%(report)s'")
-        os.chmod(self.conf["path"], stat.S_IRUSR | stat.S_IWUSR)
-        sha256_out = caller.call("sha256sum '%(compressed_report)s'")
-        checksum = sha256_out.split()[0]
+        with tracing.span("create", "archive", compressor=str(compressor)):
+            checksum = archive.create(
+                self.conf["path"],
+                self.conf["local_working_dir"],
+                arcname=os.path.basename(self.conf['path']).split('.')[0],
+                compressor=compressor,
+            )
+        with tracing.span("cleanup", "archive"):
+            shutil.rmtree(self.conf["local_tmp_dir"])
+        # Same format as sha256sum output, so it can be checked with -c
         with open("%s.sha256" % self.conf["path"], 'w') as checksum_file:
-            checksum_file.write(sha256_out)
+            checksum_file.write("%s  %s\n" % (checksum, self.conf["path"]))
+        # Reference for later --incremental runs
+        self.manifest["archive"] = os.path.basename(self.conf["path"])
+        self.manifest["sha256"] = checksum
+        # Private as the archive, it lists the hosts and their logs
+        with os.fdopen(
+            os.open(
+                "%s.%s" % (self.conf["path"], DEFAULT_MANIFEST_FILE),
+                os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                stat.S_IRUSR | stat.S_IWUSR
+            ),
+            'w'
+        ) as manifest:
+            json.dump(self.manifest, manifest)
+        tracing.write("%s.%s" % (self.conf["path"], DEFAULT_TRACE_FILE))
 
         msg = ''
         if os.path.exists(self.conf["path"]):
@@ -1319,12 +2229,158 @@ class LogCollector(object):
             for record in queue:
                 fd.write(record + "\n")
 
-    def _get_hypervisors_from_api(self):
+    def open_checkpoint(self):
+        """
+        Start the checkpoint of this collection in local_tmp_dir, or load
+        the one of the interrupted collection to resume.
+        """
+        path = os.path.join(
+            self.conf["local_tmp_dir"],
+            DEFAULT_CHECKPOINT_FILE
+        )
+        if self.conf.get("resume"):
+            self.checkpoint = checkpoint.Checkpoint.load(path)
+            logging.info(
+                _('Resuming the collection started on {started}').format(
+                    started=self.checkpoint.started,
+                )
+            )
+        else:
+            self.checkpoint = checkpoint.Checkpoint.create(path)
+
+    def skip_collected_hosts(self):
+        """
+        Remove from the selected hosts the ones collected before the
+        collection was interrupted, restoring what they recorded, and remove
+        the partial reports of the others. Returns whether hosts are left.
+        """
+        base = self.conf["local_working_dir"]
+        left = set()
+        for host in self.conf["hosts"]:
+            hostname = host.address.strip()
+            record = self.checkpoint.get_host(hostname, base)
+            if record is None:
+                partial = os.path.join(
+                    self.conf["local_scratch_dir"],
+                    hostname
+                )
+                if os.path.exists(partial):
+                    shutil.rmtree(partial)
+                left.add(host)
+                continue
+            if record.get("manifest") is not None:
+                self.manifest["hosts"][hostname] = record["manifest"]
+            if record.get("time_diff"):
+                self.time_diff_queue.append(record["time_diff"])
+        logging.info(
+            _(
+                '{collected} hypervisors were collected before the '
+                'interruption, {left} left'
+            ).format(
+                collected=len(self.conf["hosts"]) - len(left),
+                left=len(left),
+            )
+        )
+        self.conf["hosts"] = left
+        if not left:
+            self.write_time_diff(self.time_diff_queue)
+        return bool(left)
+
+    def _phase_outputs(self, phase):
+        """
+        Returns the paths of what phase writes into the working directory.
+        """
+        if phase == "engine":
+            # sos writes its report next to the scratch directory
+            directory = self.conf["local_working_dir"]
+            return [
+                os.path.join(directory, name)
+                for name in os.listdir(directory)
+                if name != os.path.basename(self.conf["local_scratch_dir"])
+            ]
+        directory = self.conf["local_scratch_dir"]
+        return [
+            os.path.join(directory, name)
+            for name in os.listdir(directory)
+            if name.startswith("postgresql-")
+        ]
+
+    def _resume_phase(self, phase):
+        """
+        Returns the checkpoint record of phase if it completed before the
+        collection was interrupted. Otherwise removes what it left and
+        returns None.
+        """
+        if self.checkpoint is None:
+            return None
+        record = self.checkpoint.get_phase(
+            phase,
+            self.conf["local_working_dir"]
+        )
+        if record is not None:
+            logging.info(
+                _(
+                    'The {phase} reports were collected before the '
+                    'interruption'
+                ).format(
+                    phase=phase,
+                )
+            )
+            return record
+        for path in self._phase_outputs(phase):
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.unlink(path)
+        return None
+
+    def _checkpoint_phase(self, phase, **details):
+        if self.checkpoint is None:
+            return
+        base = self.conf["local_working_dir"]
+        try:
+            self.checkpoint.phase_done(
+                phase,
+                [
+                    checkpoint.artifact(base, path)
+                    for path in self._phase_outputs(phase)
+                ],
+                **details
+            )
+        except EnvironmentError as e:
+            logging.warning(
+                "Cannot checkpoint the %s phase, it will run again if the "
+                "collection is resumed: %s" % (phase, e)
+            )
+
+    def _get_hypervisors_from_api(self, oquery=""):
         if not self.conf:
             raise Exception("No configuration.")
 
         with_kerberos = bool(self.conf.get("kerberos"))
 
+        cache_file = os.path.join(
+            config.DEFAULT_CACHE_DIR,
+            DEFAULT_INVENTORY_CACHE_FILE
+        )
+        cache_ttl = self.conf.get("inventory_cache_ttl") or 0
+        if cache_ttl > 0 and not self.conf.get("refresh_inventory"):
+            tree, age = hypervisors.load_cache(
+                cache_file,
+                self.conf.get("engine"),
+                cache_ttl
+            )
+            if tree is not None:
+                logging.info(
+                    _(
+                        'Using the list of hypervisors cached {age} seconds '
+                        'ago, use --refresh-inventory to fetch it again.'
+                    ).format(
+                        age=int(age),
+                    )
+                )
+                return tree
+
         if not self.conf.get("quiet") and not self.conf.get("batch"):
             try:
                 self.conf.prompt("engine", msg="hostname of oVirt Engine")
@@ -1347,16 +2403,34 @@ class LogCollector(object):
                 raise
 
         try:
-            return hypervisors.get_all(self.conf.get("engine"),
+            tree = hypervisors.get_all(self.conf.get("engine"),
                                        self.conf.get("user"),
                                        self.conf.get("passwd"),
                                        self.conf.get("cert_file"),
                                        self.conf.get("insecure"),
-                                       with_kerberos)
+                                       with_kerberos,
+                                       self.conf.get("api_concurrency") or 1,
+                                       oquery)
         except Exception as e:
             ExitCodes.exit_code = ExitCodes.WARN
             logging.error("_get_hypervisors_from_api: %s" % e)
-            return set()
+            return hypervisors.ENGINETree()
+
+        # Only the whole inventory is cached
+        if cache_ttl > 0 and tree.hosts and not oquery:
+            try:
+                hypervisors.save_cache(
+                    cache_file,
+                    self.conf.get("engine"),
+                    tree
+                )
+            except EnvironmentError as e:
+                logging.warning(
+                    _('Cannot cache the list of hypervisors: {error}').format(
+                        error=e,
+                    )
+                )
+        return tree
 
     @staticmethod
     def _sift_patterns(list_):
@@ -1376,30 +2450,6 @@ class LogCollector(object):
 
         return patterns, others
 
-    def _filter_hosts(self, which, pattern):
-        logging.debug(
-            "filtering host list with %s against %s name" % (pattern, which)
-        )
-
-        if which == "host":
-            return set([
-                (dc, cl, h, is_spm, is_up) for
-                dc, cl, h, is_spm, is_up in self.conf.get("hosts")
-                if fnmatch.fnmatch(h, pattern)
-            ])
-        elif which == "cluster":
-            return set([
-                (dc, cl, h, is_spm, is_up) for
-                dc, cl, h, is_spm, is_up in self.conf.get("hosts")
-                if fnmatch.fnmatch(cl.name, pattern)
-            ])
-        elif which == "datacenter":
-            return set([
-                (dc, cl, h, is_spm, is_up) for
-                dc, cl, h, is_spm, is_up in self.conf.get("hosts")
-                if fnmatch.fnmatch(dc, pattern)
-            ])
-
     def set_hosts(self, hypervisor_per_cluster=False):
         """
         Fetches the hostnames for the supplied cluster or datacenter.
@@ -1420,47 +2470,48 @@ class LogCollector(object):
         if host_patterns:
             self.conf['host_pattern'] = host_patterns
 
-        self.conf['hosts'] = self._get_hypervisors_from_api()
+        # Let the engine skip the hosts of other clusters and data centers,
+        # unless hosts given with -H need to be looked up among all of them
+        oquery = ""
+        if not host_others:
+            oquery = hypervisors.search_query(
+                cluster_patterns,
+                datacenter_patterns,
+            )
+        with tracing.span("inventory", "api", search=oquery):
+            self.inventory = self._get_hypervisors_from_api(oquery)
+        self.conf['hosts'] = set(self.inventory.get_sortable())
         # Filter all host specified with -H
         host_filtered = set()
         if host_others:
-            host_filtered = set([
-                (dc, cl, h, is_spm, is_up)
-                for dc, cl, h, is_spm, is_up in self.conf['hosts']
-                if h in host_others
-            ])
+            for address in host_others:
+                host = self.inventory.get_host(address)
+                if host is not None:
+                    host_filtered.add(host.get_sortable())
             not_found = host_others - set(host[2] for host in host_filtered)
             if not_found != set():
                 # try to resolve to ip specified hosts
-                for fqdn in set(not_found):
-                    try:
-                        ipaddr = socket.gethostbyname(fqdn)
-                        logging.debug('%s --> %s' % (fqdn, ipaddr))
-                        for (dc, cl, h, is_spm, is_up) in self.conf['hosts']:
-                            if h == ipaddr:
-                                host_filtered.add((dc, cl, h, is_spm, is_up))
-                                not_found.remove(fqdn)
-                    except socket.error:
-                        logging.warning(
-                            _('Cannot resolve {host}').format(
-                                host=fqdn,
-                            )
-                        )
+                with closing(self._resolve(sorted(not_found))) as resolved:
+                    for fqdn, ipaddr in resolved:
+                        if ipaddr is None:
+                            continue
+                        host = self.inventory.get_host(ipaddr)
+                        if host is not None:
+                            host_filtered.add(host.get_sortable())
+                            not_found.remove(fqdn)
             if not_found != set():
-                # try to resolve to ip known hypervisors
-                for (dc, cl, h, is_spm, is_up) in self.conf['hosts']:
-                    try:
-                        ipaddr = socket.gethostbyname(h)
-                        logging.debug('%s --> %s' % (h, ipaddr))
-                        if ipaddr in host_others:
-                            host_filtered.add((dc, cl, h, is_spm, is_up))
+                # try to resolve to ip known hypervisors, until all the
+                # specified ones are found
+                known = dict(
+                    (host.address, host) for host in self.conf['hosts']
+                )
+                with closing(self._resolve(sorted(known))) as resolved:
+                    for address, ipaddr in resolved:
+                        if ipaddr in not_found:
+                            host_filtered.add(known[address])
                             not_found.remove(ipaddr)
-                    except socket.error:
-                        logging.warning(
-                            _('Cannot resolve {host}').format(
-                                host=h,
-                            )
-                        )
+                            if not not_found:
+                                break
             if not_found != set():
                 logging.error(
                     _(
@@ -1473,52 +2524,41 @@ class LogCollector(object):
                 )
                 sys.exit(ExitCodes.CRITICAL)
 
-        orig_hosts = self.conf['hosts'].copy()
+        orig_hosts = self.conf['hosts']
 
-        if host_patterns:
-            for pattern in host_patterns:
-                host_filtered |= self._filter_hosts('host', pattern)
+        # Keep the hosts matching -H, either by pattern or as found above,
+        # and belonging to the data centers and clusters matching -d and -c
+        host_names = None
         if host_patterns or host_others:
-            self.conf['hosts'] &= host_filtered
-
-        # Intersect with hosts belonging to the data centers specified with -d
-        if datacenter_patterns:
-            datacenter_filtered = set()
-            for pattern in datacenter_patterns:
-                datacenter_filtered |= self._filter_hosts(
-                    'datacenter', pattern
-                )
-            self.conf['hosts'] &= datacenter_filtered
-
-        # Intersect with hosts belonging to the clusters specified with -c
-        if cluster_patterns:
-            # remove all hosts that don't match the patterns
-            cluster_filtered = set()
-            for pattern in cluster_patterns:
-                cluster_filtered |= self._filter_hosts('cluster', pattern)
-            self.conf['hosts'] &= cluster_filtered
+            host_names = host_patterns | set(
+                host.address for host in host_filtered
+            )
+        host_filter = hypervisors.HostFilter(
+            datacenters=datacenter_patterns or None,
+            clusters=cluster_patterns or None,
+            hosts=host_names,
+        )
+        self.conf['hosts'] = set(host_filter.select(self.inventory))
 
         # If hypervisor_per_cluster is set, collect data only from a single
         # hypervisor per cluster; if the Spm found, collect data from it.
         if hypervisor_per_cluster:
             selected_hosts = dict()
-            for dc, cluster, host, is_spm, is_up in self.conf['hosts']:
+            for host in self.conf['hosts']:
+                cluster = host.cluster.name
                 # Always add the SPM
-                if is_spm:
-                    selected_hosts[cluster.name] = (dc, cluster, host, is_spm,
-                                                    is_up)
+                if host.is_spm:
+                    selected_hosts[cluster] = host
                 # For the given cluster, if no host added yet, add it
-                elif cluster.name not in selected_hosts:
-                    selected_hosts[cluster.name] = (dc, cluster, host, is_spm,
-                                                    is_up)
+                elif cluster not in selected_hosts:
+                    selected_hosts[cluster] = host
                 # If a host is up and the SPM isn't added yet, add this host
-                elif is_up and not selected_hosts[cluster.name][3]:
-                    selected_hosts[cluster.name] = (dc, cluster, host, is_spm,
-                                                    is_up)
+                elif host.is_up and not selected_hosts[cluster].is_spm:
+                    selected_hosts[cluster] = host
             self.conf['hosts'] &= set(selected_hosts.values())
 
         # warn users if they are going to collect logs from all hosts.
-        if orig_hosts and self.conf['hosts'] == orig_hosts:
+        if orig_hosts and self.conf['hosts'] == orig_hosts and not oquery:
             logging.warning(
                 _(
                     'This ovirt-log-collector call will collect logs from '
@@ -1529,10 +2569,61 @@ class LogCollector(object):
 
         return bool(self.conf.get('hosts'))
 
+    @staticmethod
+    def _gethostbyname(name):
+        with tracing.span("resolve", "dns", host=name):
+            try:
+                return socket.gethostbyname(name)
+            except socket.error:
+                return None
+
+    def _resolve(self, names):
+        """
+        Resolve names, DNS_CONCURRENCY at once, yielding (name, address) as
+        each one is resolved; address is None if name can't be resolved.
+        Results are cached for the rest of the run. The lookups not started
+        yet are cancelled when the generator is closed.
+        """
+        pending = []
+        for name in names:
+            if name in self._addresses:
+                yield name, self._addresses[name]
+            else:
+                pending.append(name)
+        if not pending:
+            return
+        executor = ThreadPoolExecutor(
+            max_workers=min(DNS_CONCURRENCY, len(pending)),
+            thread_name_prefix="dns",
+        )
+        futures = dict(
+            (executor.submit(self._gethostbyname, name), name)
+            for name in pending
+        )
+        try:
+            for future in as_completed(futures):
+                name = futures[future]
+                address = future.result()
+                self._addresses[name] = address
+                if address is None:
+                    logging.warning(
+                        _('Cannot resolve {host}').format(
+                            host=name,
+                        )
+                    )
+                else:
+                    logging.debug('%s --> %s' % (name, address))
+                yield name, address
+        finally:
+            for future in futures:
+                future.cancel()
+            # Lookups in progress can't be interrupted, don't wait for them
+            executor.shutdown(wait=False)
+
     def list_hosts(self):
 
-        def get_host(tuple_):
-            return tuple_[2]
+        def get_host(host):
+            return host.address
 
         host_list = list(self.conf.get("hosts"))
         host_list.sort(key=get_host)
@@ -1547,78 +2638,313 @@ host=%(host_pattern)s):" % self.conf)
             dc, cluster, host, is_spm, is_up in host_list
         ))
 
-    def get_hypervisor_data(self):
+    def confirm_hypervisor_collection(self):
+        """
+        Ask the user to confirm the collection from the selected hypervisors.
+        Must be called before the collection phases are started, since they
+        run concurrently and can't prompt.
+        """
         hosts = self.conf.get("hosts")
 
-        if hosts:
-            if not self.conf.get("quiet") and not self.conf.get("batch"):
-                # Check if there are more than MAX_WARN_HOSTS_COUNT hosts
-                # to collect from
-                if len(hosts) >= MAX_WARN_HOSTS_COUNT:
-                    logging.warning(
-                        _("{number} hypervisors detected. It might take some "
-                          "time to collect logs from {number} hypervisors. "
-                          "You can use the following filters -c, -d, -H. "
-                          "For more information use -h".format(
-                              number=len(hosts),
-                          ))
-                    )
-                    _continue = \
-                        get_from_prompt(msg="Do you want to proceed(Y/n)",
-                                        default='y')
-                    if _continue not in ('Y', 'y'):
-                        logging.info(
-                            _("Aborting hypervisor collection...")
-                        )
-                        return
-                else:
-                    continue_ = get_from_prompt(
-                        msg="About to collect information from "
-                            "{len} hypervisors. Continue? (Y/n): ".format(
-                                len=len(hosts),
-                            ),
-                        default='y'
+        if not hosts:
+            return False
+
+        if not self.conf.get("quiet") and not self.conf.get("batch"):
+            # Check if there are more than MAX_WARN_HOSTS_COUNT hosts
+            # to collect from
+            if len(hosts) >= MAX_WARN_HOSTS_COUNT:
+                logging.warning(
+                    _("{number} hypervisors detected. It might take some "
+                      "time to collect logs from {number} hypervisors. "
+                      "You can use the following filters -c, -d, -H. "
+                      "For more information use -h".format(
+                          number=len(hosts),
+                      ))
+                )
+                _continue = \
+                    get_from_prompt(msg="Do you want to proceed(Y/n)",
+                                    default='y')
+                if _continue not in ('Y', 'y'):
+                    logging.info(
+                        _("Aborting hypervisor collection...")
                     )
+                    return False
+            else:
+                continue_ = get_from_prompt(
+                    msg="About to collect information from "
+                        "{len} hypervisors. Continue? (Y/n): ".format(
+                            len=len(hosts),
+                        ),
+                    default='y'
+                )
 
-                    if continue_ not in ('y', 'Y'):
-                        logging.info("Aborting hypervisor collection...")
-                        return
+                if continue_ not in ('y', 'Y'):
+                    logging.info("Aborting hypervisor collection...")
+                    return False
+
+        return True
+
+    def run_phases(self, *phases):
+        """
+        Run the given collection phases concurrently and wait for all of
+        them to finish. The first exception raised by a phase is re-raised
+        once every phase has been joined.
+        The first phase runs in the calling thread, where asyncio can watch
+        its child processes on every Python version.
+        """
+        errors = []
+
+        def run_phase(phase):
+            try:
+                with tracing.span(phase.__name__, "phase"):
+                    phase()
+            except Exception as e:
+                multilog(logging.debug, traceback.format_exc())
+                errors.append(e)
+
+        threads = []
+        for phase in phases[1:]:
+            thread = threading.Thread(
+                target=run_phase,
+                args=(phase,),
+                name=phase.__name__,
+            )
+            # Don't keep the process alive on user cancel
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        try:
+            if phases:
+                run_phase(phases[0])
 
+            for thread in threads:
+                thread.join()
+        except BaseException:
+            # The other phases would leave their programs, such as the
+            # local sosreports, running after the exit
+            Caller.terminate_running()
+            for thread in threads:
+                thread.join(PHASE_STOP_TIMEOUT)
+            raise
+
+        if errors:
+            raise errors[0]
+
+    def get_hypervisor_data(self):
+        hosts = self.conf.get("hosts")
+
+        if hosts:
             dump_chains = self._get_dump_chains_hosts()
 
             logging.info("Gathering information from selected hypervisors...")
 
             max_connections = self.conf.get("max_connections", 10)
-
-            import threading
-            from collections import deque
-
-            # max_connections may be defined as a string via a .rc file
-            sem = threading.Semaphore(int(max_connections))
-            time_diff_queue = deque()
-
-            threads = []
-
-            for datacenter, cluster, host, is_spm, is_up in hosts:
-                sem.acquire(True)
-                collector = HyperVisorData(
-                    host.strip(),
-                    configuration=self.conf,
-                    semaphore=sem,
-                    queue=time_diff_queue,
-                    gluster_enabled=cluster.gluster_enabled,
-                    dump_volume_chains=(dump_chains[datacenter] == host),
-                    time_diff_only=self.conf.get("time_only")
+            time_diff_queue = self.time_diff_queue
+
+            configuration = self.conf.copy()
+            # scp processes can't share a budget, each gets its share of the
+            # global one. The limit of scp is in Kbit/s.
+            rates = []
+            if self.conf.get("bandwidth_limit"):
+                rates.append(
+                    self.conf["bandwidth_limit"] / int(max_connections)
+                )
+            if self.conf.get("host_bandwidth_limit"):
+                rates.append(self.conf["host_bandwidth_limit"])
+            if rates:
+                configuration["scp_bandwidth_limit"] = max(
+                    1,
+                    int(min(rates) * 8)
+                )
+            if not self.conf.get("no_ssh_multiplexing"):
+                # Kept short and outside local_tmp_dir: the sockets paths
+                # must fit in sun_path.
+                configuration["ssh_control_dir"] = tempfile.mkdtemp(
+                    prefix="olc-ssh-"
                 )
-                thread = threading.Thread(target=collector.run)
-                thread.start()
-                threads.append(thread)
 
-            for thread in threads:
-                thread.join()
+            base_hosts = (self.base_manifest or {}).get("hosts", {})
+            plugins_cache = self._load_capabilities()
+
+            loop = asyncio.new_event_loop()
+            # Lets the child watcher of older Pythons attach to this loop
+            asyncio.set_event_loop(loop)
+            try:
+                # max_connections may be defined as a string via a .rc file
+                if self.conf.get("adaptive_connections"):
+                    limiter = concurrency.AdaptiveLimiter(
+                        int(max_connections)
+                    )
+                    monitor = limiter
+                else:
+                    limiter = asyncio.Semaphore(int(max_connections))
+                    monitor = None
+
+                buckets = []
+                if self.conf.get("bandwidth_limit"):
+                    buckets.append(
+                        concurrency.TokenBucket(
+                            self.conf["bandwidth_limit"] * 1024
+                        )
+                    )
+
+                tracker = progress.Progress(
+                    live=(
+                        sys.stdout.isatty() and
+                        not self.conf.get("quiet") and
+                        not self.conf.get("batch")
+                    ),
+                )
+                collectors = []
+
+                for datacenter, cluster, host, is_spm, is_up in hosts:
+                    collector = HyperVisorData(
+                        host.strip(),
+                        configuration=configuration,
+                        queue=time_diff_queue,
+                        gluster_enabled=cluster.gluster_enabled,
+                        dump_volume_chains=(dump_chains[datacenter] == host),
+                        time_diff_only=self.conf.get("time_only"),
+                        manifest=self.manifest["hosts"],
+                        # Keep listing the logs of incremental chains
+                        list_logs=(
+                            self.conf.get("list_logs") or
+                            "files" in base_hosts.get(host.strip(), {})
+                        ),
+                        since=self._base_time(
+                            host.strip(),
+                            base_hosts.get(host.strip())
+                        ),
+                        monitor=monitor,
+                        buckets=buckets,
+                        host_progress=tracker.add(host.strip()),
+                        checkpoint=self.checkpoint,
+                        capabilities=plugins_cache,
+                    )
+                    collectors.append(collector)
+
+                self._run_collectors(loop, collectors, limiter, tracker)
+                logging.info("Hypervisors: %s" % tracker.summary())
+            finally:
+                asyncio.set_event_loop(None)
+                loop.close()
+                if configuration.get("ssh_control_dir"):
+                    shutil.rmtree(configuration["ssh_control_dir"])
+                self._save_capabilities(plugins_cache)
+
+            timed_out = [
+                collector.hostname
+                for collector in collectors
+                if collector.timed_out
+            ]
+            if timed_out:
+                logging.warning(
+                    _(
+                        'Timed out collecting from {count} hypervisors: '
+                        '{hosts}'
+                    ).format(
+                        count=len(timed_out),
+                        hosts=', '.join(sorted(timed_out)),
+                    )
+                )
 
             self.write_time_diff(time_diff_queue)
 
+    def _load_capabilities(self):
+        """
+        Returns the capabilities.Cache of the sos plugins of the engine and
+        hypervisors, empty if they must be listed again. It is loaded once
+        and shared by the phases, which run in their own threads.
+        """
+        with self._capabilities_lock:
+            if self._capabilities is None:
+                path = os.path.join(
+                    config.DEFAULT_CACHE_DIR,
+                    DEFAULT_CAPABILITIES_CACHE_FILE
+                )
+                if self.conf.get("refresh_sos_plugins"):
+                    self._capabilities = capabilities.Cache(path)
+                else:
+                    self._capabilities = capabilities.Cache.load(path)
+            return self._capabilities
+
+    @staticmethod
+    def _save_capabilities(cache):
+        try:
+            cache.save()
+        except EnvironmentError as e:
+            logging.warning(
+                _('Cannot cache the sos plugins: {error}').format(
+                    error=e,
+                )
+            )
+
+    @staticmethod
+    def _run_collectors(loop, collectors, limiter, tracker=None):
+        """
+        Run the collectors as tasks of loop, as many at once as limiter, an
+        asyncio.Semaphore or a concurrency.AdaptiveLimiter, admits. Their
+        hosts are all probed up front, through the same limiter. If
+        interrupted, the running collectors are cancelled, which kills their
+        commands, before returning.
+        @param tracker: optional progress.Progress of the collectors, reported
+            while they run
+        """
+
+        async def probe(collector):
+            async with limiter:
+                await collector.probe()
+
+        async def collect(collector):
+            # Its probe holds a connection meanwhile, run() handles how it
+            # ended
+            await asyncio.wait([collector.probing])
+            async with limiter:
+                with tracing.span(
+                    "collect",
+                    "hypervisor",
+                    track=collector.hostname,
+                ) as details:
+                    await collector.run()
+                    details["state"] = collector.progress.state
+                    details["bytes"] = collector.progress.bytes
+
+        async def collect_all():
+            background = []
+            if isinstance(limiter, concurrency.AdaptiveLimiter):
+                background.append(asyncio.ensure_future(limiter.run()))
+            if tracker is not None:
+                background.append(asyncio.ensure_future(tracker.run()))
+            # Every host is probed up front, each collector then waits for
+            # the probe of its host
+            for collector in collectors:
+                collector.probing = asyncio.ensure_future(probe(collector))
+                background.append(collector.probing)
+            try:
+                # When cancelled, waits for every collector to clean up
+                # instead of returning as soon as the first one is done
+                await asyncio.gather(
+                    *[collect(collector) for collector in collectors],
+                    return_exceptions=True
+                )
+            finally:
+                for task in background:
+                    task.cancel()
+                # Let them clean up, the progress view erases itself
+                await asyncio.gather(*background, return_exceptions=True)
+
+        task = loop.create_task(collect_all())
+        try:
+            loop.run_until_complete(task)
+        except BaseException:
+            task.cancel()
+            try:
+                loop.run_until_complete(task)
+            except BaseException:
+                pass
+            raise
+
     def _get_dump_chains_hosts(self):
         """
         Find hosts to run dump-volume-chains. Only hosts in UP state are
@@ -1642,54 +2968,103 @@ host=%(host_pattern)s):" % self.conf)
 
         return dump_chains
 
-    def get_postgres_data(self):
+    def prompt_postgres_password(self):
+        """
+        Ask for the PostgreSQL password if needed. Must be called before
+        the collection phases are started, since they can't prompt.
+        """
         if self.conf.get("no_postgresql") is False:
             try:
-                try:
-                    if not self.conf.get("pg_pass"):
-                        self.conf.getpass(
-                            "pg_pass",
-                            msg="password for the PostgreSQL user, %s, \
+                if not self.conf.get("pg_pass"):
+                    self.conf.getpass(
+                        "pg_pass",
+                        msg="password for the PostgreSQL user, %s, \
 to dump the %s PostgreSQL database instance" %
-                                (
-                                    self.conf.get('pg_user'),
-                                    self.conf.get('pg_dbname')
-                                )
-                        )
-                    logging.info(
-                        "Gathering PostgreSQL the oVirt Engine database and \
-log files from %s..." % (self.conf.get("pg_dbhost"))
+                            (
+                                self.conf.get('pg_user'),
+                                self.conf.get('pg_dbname')
+                            )
                     )
-                except Configuration.SkipException:
-                    logging.info(
-                        "PostgreSQL oVirt Engine database \
+                logging.info(
+                    "Gathering PostgreSQL the oVirt Engine database and \
+log files from %s..." % (self.conf.get("pg_dbhost"))
+                )
+            except Configuration.SkipException:
+                logging.info(
+                    "PostgreSQL oVirt Engine database \
 will not be collected."
+                )
+                logging.info(
+                    "Gathering PostgreSQL log files from %s..." % (
+                        self.conf.get("pg_dbhost")
                     )
-                    logging.info(
-                        "Gathering PostgreSQL log files from %s..." % (
-                            self.conf.get("pg_dbhost")
-                        )
-                    )
+                )
+        else:
+            ExitCodes.exit_code = ExitCodes.NOERR
+            logging.info("Skipping postgresql collection...")
 
+    def get_postgres_data(self):
+        if self.conf.get("no_postgresql") is False:
+            if self._resume_phase("postgres") is not None:
+                return
+            try:
                 collector = PostgresData(self.conf.get("pg_dbhost"),
                                          configuration=self.conf)
-                collector.sosreport()
+                with tracing.span("postgres sosreport", "sosreport"):
+                    collector.sosreport()
+                self._checkpoint_phase("postgres")
             except Exception as e:
                 ExitCodes.exit_code = ExitCodes.WARN
                 logging.error(
                     "Could not collect PostgreSQL information: %s" % e
                 )
-        else:
-            ExitCodes.exit_code = ExitCodes.NOERR
-            logging.info("Skipping postgresql collection...")
 
     def get_engine_data(self):
+        record = self._resume_phase("engine")
+        if record is not None:
+            self.manifest["engine"]["time"] = record.get("time")
+            return
         logging.info("Gathering oVirt Engine information...")
-        collector = ENGINEData(
-            "localhost",
-            configuration=self.conf
+        configuration = self.conf.copy()
+        if self.base_manifest:
+            # Only recorded once the engine sosreport completed
+            configuration["sos_since"] = self.base_manifest.get(
+                "engine", {}
+            ).get("time")
+        started = datetime.datetime.now().strftime(SOS_SINCE_FORMAT)
+        with tracing.span("engine sosreport", "sosreport"):
+            plugins_cache = self._load_capabilities()
+            collector = ENGINEData(
+                "localhost",
+                configuration=configuration,
+                capabilities=plugins_cache,
+            )
+            self._save_capabilities(plugins_cache)
+            collector.sosreport()
+        self.manifest["engine"]["time"] = started
+        self._checkpoint_phase(
+            "engine",
+            time=self.manifest["engine"]["time"]
+        )
+
+
+def resume_hint(conf):
+    """
+    Tell how to resume a collection that was interrupted after its
+    checkpoint was started.
+    """
+    if (
+        conf is not None and
+        conf.command == "collect" and
+        conf.get("local_tmp_dir") and
+        os.path.exists(
+            os.path.join(conf["local_tmp_dir"], DEFAULT_CHECKPOINT_FILE)
+        )
+    ):
+        print(
+            "The collection can be resumed by running it again with: "
+            "--resume --local-tmp=%s" % conf["local_tmp_dir"]
         )
-        collector.sosreport()
 
 
 def parse_password(option, opt_str, value, parser):
@@ -1770,7 +3145,8 @@ to continue.
         "", "--local-tmp", dest="local_tmp_dir",
         help="directory to copy reports to locally. "
              "Please note that the directory must be empty (if already "
-             "exists) and will be removed upon completion. "
+             "exists), unless --resume is given, and will be removed upon "
+             "completion. "
              "(default is randomly generated like: %s)" % DEFAULT_SCRATCH_DIR,
         metavar="PATH",
         default=DEFAULT_SCRATCH_DIR
@@ -1801,7 +3177,8 @@ to continue.
     parser.add_option(
         "", "--quiet", dest="quiet",
         action="store_true", default=False,
-        help="reduce console output (default=False)"
+        help="reduce console output to the errors, the progress of the \
+collection is not shown (default=False)"
     )
 
     parser.add_option(
@@ -1850,6 +3227,57 @@ to continue.
         default=tempfile.gettempdir()
     )
 
+    parser.add_option(
+        "", "--compressor", dest="compressor",
+        help="program used to compress the final archive, one of: auto, "
+             "%s. auto picks xz, then pbzip2, then bzip2 (default=auto)" % (
+                 ", ".join(sorted(archive.COMPRESSORS))
+             ),
+        type="choice",
+        choices=["auto"] + sorted(archive.COMPRESSORS),
+        metavar="COMPRESSOR",
+        default="auto"
+    )
+
+    parser.add_option(
+        "", "--compress-threads", dest="compress_threads",
+        help="number of threads used by the parallel compressors, "
+             "0 uses one thread per CPU (default=0)",
+        metavar="THREADS",
+        type="int",
+        default=0
+    )
+
+    parser.add_option(
+        "", "--resume", dest="resume",
+        help="resume the interrupted collection whose reports are in the "
+             "directory given with --local-tmp: only the hypervisors, "
+             "engine and PostgreSQL reports it is missing are collected "
+             "before the archive is created (default=False)",
+        action="store_true",
+        default=False
+    )
+
+    parser.add_option(
+        "", "--incremental", dest="incremental",
+        help="manifest of a previous collection (the .manifest.json file "
+             "stored next to its archive): only the logs modified since "
+             "that collection are gathered from the engine and from the "
+             "hypervisors already part of it",
+        metavar="MANIFEST"
+    )
+
+    parser.add_option(
+        "", "--list-logs", dest="list_logs",
+        help="record in the manifest the path, size and modification time "
+             "of the log files of each hypervisor, so later --incremental "
+             "collections report which of them changed. Implied for the "
+             "hypervisors whose logs the --incremental manifest lists "
+             "(default=False)",
+        action="store_true",
+        default=False
+    )
+
     parser.add_option(
         "", "--include-sensitive-data", dest="include_sensitive_data",
         action="store_true", default=False,
@@ -1928,6 +3356,42 @@ This should be in UPN format.",
         default="localhost:443"
     )
 
+    engine_group.add_option(
+        "", "--api-concurrency", dest="api_concurrency",
+        help="maximum number of pages of data centers, clusters and hosts "
+             "requested at once to the REST API, 1 requests one page at a "
+             "time (default=4)",
+        metavar="REQUESTS",
+        type="int",
+        default=4
+    )
+
+    engine_group.add_option(
+        "", "--inventory-cache-ttl", dest="inventory_cache_ttl",
+        help="number of seconds the list of hypervisors fetched from the "
+             "REST API is reused by the following invocations, 0 disables "
+             "the cache (default=0)",
+        metavar="SECONDS",
+        type="int",
+        default=0
+    )
+
+    engine_group.add_option(
+        "", "--refresh-inventory", dest="refresh_inventory",
+        help="fetch the list of hypervisors from the REST API even if a "
+             "cached one is still valid (default=False)",
+        action="store_true",
+        default=False
+    )
+
+    engine_group.add_option(
+        "", "--refresh-sos-plugins", dest="refresh_sos_plugins",
+        help="list the sos plugins of the engine and hypervisors even if "
+             "they are cached for their sos version (default=False)",
+        action="store_true",
+        default=False
+    )
+
     engine_group.add_option(
         "-c", "--cluster", dest="cluster",
         help="pattern, or comma separated list of patterns to filter the host \
@@ -1982,6 +3446,34 @@ for the SSH password.""" % config.DEFAULT_SSH_KEY,
         default=config.DEFAULT_SSH_KEY
     )
 
+    ssh_group.add_option(
+        "", "--no-ssh-multiplexing", dest="no_ssh_multiplexing",
+        help="open a new SSH connection for each command run on a \
+hypervisor instead of sharing a single connection per hypervisor \
+(default=False)",
+        action="store_true",
+        default=False
+    )
+
+    # Lets the benchmarks run stand-ins of ssh and scp
+    ssh_group.add_option(
+        "",
+        "--ssh-bin-dir",
+        dest="ssh_bin_dir",
+        help=SUPPRESS_HELP
+    )
+
+    ssh_group.add_option(
+        "", "--transfer-mode", dest="transfer_mode",
+        help="how hypervisor reports are copied to this host: 'stream' \
+sends them over the ssh connection and removes them in a single call, \
+'scp' copies them with scp and removes them afterwards (default=stream)",
+        type="choice",
+        choices=["stream", "scp"],
+        metavar="MODE",
+        default="stream"
+    )
+
     ssh_group.add_option(
         "", "--max-connections", dest="max_connections",
         help="max concurrent connections for fetching hypervisor logs \
@@ -1989,6 +3481,78 @@ for the SSH password.""" % config.DEFAULT_SSH_KEY,
         default=10
     )
 
+    ssh_group.add_option(
+        "", "--bandwidth-limit", dest="bandwidth_limit",
+        help="maximum rate in KiB/s at which the reports of all the \
+hypervisors together are copied, 0 for no limit (default=0)",
+        type="int",
+        metavar="RATE",
+        default=0
+    )
+
+    ssh_group.add_option(
+        "", "--host-bandwidth-limit", dest="host_bandwidth_limit",
+        help="maximum rate in KiB/s at which the report of each hypervisor \
+is copied, 0 for no limit (default=0)",
+        type="int",
+        metavar="RATE",
+        default=0
+    )
+
+    ssh_group.add_option(
+        "", "--adaptive-connections", dest="adaptive_connections",
+        help="start with a few concurrent connections to the hypervisors \
+and adjust their number, up to --max-connections, to the load average, \
+disk write latency and transfer throughput of this host (default=False)",
+        action="store_true",
+        default=False
+    )
+
+    ssh_group.add_option(
+        "", "--sosreport-timeout", dest="sosreport_timeout",
+        help="seconds to wait for the sosreport of a hypervisor, 0 for no \
+limit (default=0)",
+        type="int",
+        metavar="SECONDS",
+        default=0
+    )
+
+    ssh_group.add_option(
+        "", "--transfer-timeout", dest="transfer_timeout",
+        help="seconds to wait for the report of a hypervisor to be copied, \
+0 for no limit (default=0)",
+        type="int",
+        metavar="SECONDS",
+        default=0
+    )
+
+    ssh_group.add_option(
+        "", "--listing-timeout", dest="listing_timeout",
+        help="seconds to wait for each file listing of a hypervisor, 0 for \
+no limit (default=0)",
+        type="int",
+        metavar="SECONDS",
+        default=0
+    )
+
+    ssh_group.add_option(
+        "", "--probe-timeout", dest="probe_timeout",
+        help="seconds to wait for the probe of a hypervisor, which gets its \
+sos version, free space, load and date, 0 for no limit (default=0)",
+        type="int",
+        metavar="SECONDS",
+        default=0
+    )
+
+    ssh_group.add_option(
+        "", "--host-timeout", dest="host_timeout",
+        help="seconds to wait for the whole collection from a hypervisor, \
+0 for no limit (default=0)",
+        type="int",
+        metavar="SECONDS",
+        default=0
+    )
+
     db_group = OptionGroup(
         parser,
         "PostgreSQL Database Configuration",
@@ -2069,12 +3633,17 @@ host upon which the PostgreSQL database lives
     parser.add_option_group(db_group)
     parser.parse_args()
 
+    conf = None
     try:
         conf = Configuration(parser)
         if not conf.get('pg_pass') and pg_pass:
             conf['pg_pass'] = pg_pass
         collector = LogCollector(conf)
 
+        # An interrupted collection is resumed from the reports already in
+        # its directories
+        resume = conf.command == "collect" and conf.get("resume")
+
         # We must ensure that the directory exists before
         # we start doing anything.
         if os.path.exists(conf["local_tmp_dir"]):
@@ -2083,11 +3652,29 @@ host upon which the PostgreSQL database lives
                     '%s is not a directory.' % (conf["local_tmp_dir"])
                 )
 
+            if resume:
+                if not os.path.exists(
+                    os.path.join(
+                        conf["local_tmp_dir"],
+                        DEFAULT_CHECKPOINT_FILE
+                    )
+                ):
+                    raise Exception(
+                        '%s has no collection to resume.' % (
+                            conf["local_tmp_dir"]
+                        )
+                    )
             # We must also ensure that existing directory is empty
-            if os.listdir(conf["local_tmp_dir"]):
+            elif os.listdir(conf["local_tmp_dir"]):
                 raise Exception(
                     '%s directory is not empty.' % (conf["local_tmp_dir"])
                 )
+        elif resume:
+            raise Exception(
+                '%s does not exist, there is no collection to resume.' % (
+                    conf["local_tmp_dir"]
+                )
+            )
         else:
             logging.info(
                 "%s does not exist.  It will be created." % (
@@ -2104,7 +3691,7 @@ host upon which the PostgreSQL database lives
         try:
             os.makedirs(conf["local_working_dir"])
         except OSError:
-            if len(os.listdir(conf["local_working_dir"])) != 0:
+            if not resume and len(os.listdir(conf["local_working_dir"])) != 0:
                 raise Exception(
                     "The working directory is not empty.\n"
                     "It should be empty so that reports from a prior "
@@ -2125,7 +3712,7 @@ host upon which the PostgreSQL database lives
         )
         if not os.path.exists(conf["local_scratch_dir"]):
             os.makedirs(conf["local_scratch_dir"])
-        else:
+        elif not resume:
             if len(os.listdir(conf["local_scratch_dir"])) != 0:
                 raise Exception("""the scratch directory for temporary storage
 of hypervisor reports is not empty.
@@ -2134,7 +3721,9 @@ are not collected again.
 The directory is: %s'""" % (conf["local_scratch_dir"]))
 
         if conf.command == "collect":
+            collector.open_checkpoint()
             hosts_present = None
+            all_collected = False
             e = None
             try:
                 if conf.get("hypervisor_per_cluster"):
@@ -2143,13 +3732,23 @@ The directory is: %s'""" % (conf["local_scratch_dir"]))
                     hosts_present = collector.set_hosts()
             except Exception:
                 pass
-            collector.get_engine_data()
-            collector.get_postgres_data()
+            if hosts_present and resume:
+                hosts_present = collector.skip_collected_hosts()
+                all_collected = not hosts_present
+            # Prompts must happen before the phases are started, hypervisor
+            # collection goes first so the hosts start working right away.
+            phases = []
             if hosts_present:
-                collector.get_hypervisor_data()
+                if collector.confirm_hypervisor_collection():
+                    phases.append(collector.get_hypervisor_data)
             else:
                 if conf.get("no_hypervisor"):
                     logging.info("Skipping hypervisor collection...")
+                elif all_collected:
+                    logging.info(
+                        "All the selected hypervisors were collected before "
+                        "the interruption."
+                    )
                 elif e:
                     logging.info("Hypervisor data will not be collected, Error"
                                  " while selecting hypervisors\nReason:"
@@ -2158,6 +3757,11 @@ The directory is: %s'""" % (conf["local_scratch_dir"]))
                     logging.info(
                         "No hypervisors were selected, therefore no "
                         "hypervisor data will be collected.")
+            collector.prompt_postgres_password()
+            phases.append(collector.get_engine_data)
+            phases.append(collector.get_postgres_data)
+            collector.run_phases(*phases)
+            collector.write_manifest()
             stdout = collector.archive()
             logging.info(stdout)
         elif conf.command == "list":
@@ -2170,8 +3774,10 @@ data will be listed.")
 
     except KeyboardInterrupt:
         print("Exiting on user cancel.")
+        resume_hint(conf)
     except Exception as e:
         multilog(logging.error, e)
+        resume_hint(conf)
         print("Use the -h option to see usage.")
         logging.debug("Configuration:")
         try:
@@ -1 +1,9 @@
-__all__ = ["hypervisors"]
+__all__ = [
+    "archive",
+    "capabilities",
+    "checkpoint",
+    "concurrency",
+    "hypervisors",
+    "progress",
+    "tracing",
+]
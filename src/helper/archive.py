@@ -0,0 +1,692 @@
+"""
+This module builds the final log collector archive in a single pass: the
+collected tree is walked, tarred, compressed and hashed while it is written,
+so only the compressed archive ever hits the disk.
+
+Members which are already compressed (the hosts and PostgreSQL sosreports)
+are written in the stored, not compressed, flavour of the archive format.
+This relies on every supported format allowing concatenated streams.
+"""
+
+import bz2
+import copy
+import hashlib
+import logging
+import os
+import shutil
+import stat
+import struct
+import subprocess
+import tarfile
+import threading
+import zlib
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from . import tracing
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+
+PIPE_CHUNK_SIZE = 1 << 20
+
+# zstd seekable format, see contrib/seekable_format in the zstd sources
+ZSTD_FRAME_SIZE = 8 << 20
+ZSTD_SKIPPABLE_MAGIC = 0x184D2A5E
+ZSTD_SEEKABLE_MAGIC = 0x8F92EAB1
+ZSTD_FRAME_MAGIC = 0xFD2FB528
+ZSTD_RAW_BLOCK_SIZE = 128 << 10
+# Window_Descriptor for a 128 KiB window, enough for raw blocks
+ZSTD_RAW_WINDOW_DESCRIPTOR = 7 << 3
+
+XZ_HEADER_MAGIC = b'\xfd7zXZ\x00'
+XZ_FOOTER_MAGIC = b'YZ'
+# No integrity check, the archive sha256 covers it
+XZ_STREAM_FLAGS = b'\x00\x00'
+XZ_UNCOMPRESSED_CHUNK_SIZE = 64 << 10
+
+# Smaller compressed members are not worth a new stream
+STORE_MIN_SIZE = 1 << 20
+COMPRESSED_MAGICS = (
+    b'\xfd7zXZ\x00',     # xz
+    b'\x1f\x8b',          # gzip
+    b'\x28\xb5\x2f\xfd',  # zstd
+    b'\x04\x22\x4d\x18',  # lz4
+    b'\x89LZO',          # lzop
+)
+
+
+def _is_compressed(fileobj):
+    """
+    Returns True if the content of fileobj starts with the magic of a
+    compressed format. Rewinds fileobj.
+    """
+    magic = fileobj.read(6)
+    fileobj.seek(0)
+    if magic.startswith(COMPRESSED_MAGICS):
+        return True
+    # bzip2: 'BZh' and the block size
+    return magic[:3] == b'BZh' and magic[3:4] in b'123456789'
+
+
+class _Done(object):
+    """
+    Already available result, in place of a Future.
+    """
+
+    def __init__(self, value):
+        self._value = value
+
+    def result(self):
+        return self._value
+
+    def cancel(self):
+        return False
+
+
+class _HashingWriter(object):
+    """
+    Write-only file object computing the sha256 of the data written to the
+    wrapped file object.
+    """
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self._sha256 = hashlib.sha256()
+        self._size = 0
+
+    def write(self, data):
+        self._sha256.update(data)
+        self._size += len(data)
+        return self._fileobj.write(data)
+
+    def tell(self):
+        return self._size
+
+    def flush(self):
+        self._fileobj.flush()
+
+    def hexdigest(self):
+        return self._sha256.hexdigest()
+
+
+class _PipeWriter(object):
+    """
+    Write-only file object feeding an external compressor, whose output is
+    copied to fileobj by a reader thread.
+    """
+
+    def __init__(self, argv, fileobj):
+        logging.debug("compressing with(%s)" % argv)
+        self._argv = argv
+        self._fileobj = fileobj
+        self._error = None
+        self._proc = subprocess.Popen(
+            argv,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        self._reader = threading.Thread(target=self._copy_output)
+        self._reader.daemon = True
+        self._reader.start()
+
+    def _copy_output(self):
+        try:
+            for chunk in iter(
+                partial(self._proc.stdout.read, PIPE_CHUNK_SIZE),
+                b''
+            ):
+                self._fileobj.write(chunk)
+        except Exception as e:
+            self._error = e
+            # Unblock the writer side
+            self._proc.kill()
+
+    def write(self, data):
+        return self._proc.stdin.write(data)
+
+    def close(self, abort=False):
+        if abort:
+            self._proc.kill()
+        try:
+            self._proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        self._reader.join()
+        errors = self._proc.stderr.read()
+        self._proc.stderr.close()
+        self._proc.stdout.close()
+        returncode = self._proc.wait()
+        if abort:
+            return
+        if self._error is not None:
+            raise self._error
+        if returncode != 0:
+            raise Exception(
+                "%s failed(%s): %s" % (
+                    self._argv[0],
+                    returncode,
+                    errors.decode("utf-8"),
+                )
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(abort=exc_type is not None)
+
+
+class _XzStoredWriter(object):
+    """
+    Write-only file object producing an xz stream made of uncompressed
+    LZMA2 chunks, readable by any xz decoder.
+    """
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self._buffer = bytearray()
+        self._size = 0
+        self._first_chunk = True
+        self._fileobj.write(
+            XZ_HEADER_MAGIC +
+            XZ_STREAM_FLAGS +
+            struct.pack('<I', zlib.crc32(XZ_STREAM_FLAGS))
+        )
+        # Block header of 12 bytes (size field: 12 / 4 - 1), no optional
+        # sizes, a single LZMA2 filter (0x21) with a 4 KiB dictionary,
+        # padding to a multiple of 4
+        header = bytes((2, 0x00, 0x21, 0x01, 0x00, 0, 0, 0))
+        header += struct.pack('<I', zlib.crc32(header))
+        self._fileobj.write(header)
+        self._block_size = len(header)
+
+    def _write_chunk(self, data):
+        # 0x01: uncompressed chunk resetting the dictionary, 0x02: without
+        # reset; followed by the chunk size - 1, big endian
+        control = 0x01 if self._first_chunk else 0x02
+        self._first_chunk = False
+        self._fileobj.write(struct.pack('>BH', control, len(data) - 1))
+        self._fileobj.write(data)
+        self._block_size += 3 + len(data)
+        self._size += len(data)
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= XZ_UNCOMPRESSED_CHUNK_SIZE:
+            self._write_chunk(self._buffer[:XZ_UNCOMPRESSED_CHUNK_SIZE])
+            del self._buffer[:XZ_UNCOMPRESSED_CHUNK_SIZE]
+        return len(data)
+
+    def close(self, abort=False):
+        if abort:
+            return
+        if self._buffer:
+            self._write_chunk(self._buffer)
+            self._buffer = bytearray()
+        # LZMA2 end marker
+        self._fileobj.write(b'\x00')
+        unpadded_size = self._block_size + 1
+        self._fileobj.write(b'\x00' * (-unpadded_size % 4))
+
+        index = (
+            b'\x00' +
+            _xz_multibyte(1) +
+            _xz_multibyte(unpadded_size) +
+            _xz_multibyte(self._size)
+        )
+        index += b'\x00' * (-len(index) % 4)
+        index += struct.pack('<I', zlib.crc32(index))
+        self._fileobj.write(index)
+
+        backward = struct.pack('<I', len(index) // 4 - 1) + XZ_STREAM_FLAGS
+        self._fileobj.write(
+            struct.pack('<I', zlib.crc32(backward)) +
+            backward +
+            XZ_FOOTER_MAGIC
+        )
+
+
+def _xz_multibyte(value):
+    encoded = bytearray()
+    while value >= 0x80:
+        encoded.append(value & 0x7F | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+class _GzipStoredWriter(object):
+    """
+    Write-only file object producing a gzip member made of stored deflate
+    blocks.
+    """
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self._deflate = zlib.compressobj(0, zlib.DEFLATED, 31)
+
+    def write(self, data):
+        self._fileobj.write(self._deflate.compress(data))
+        return len(data)
+
+    def close(self, abort=False):
+        if not abort:
+            self._fileobj.write(self._deflate.flush())
+
+
+class _SegmentedWriter(object):
+    """
+    Write-only file object compressing into fileobj, except for the ranges
+    announced with store_next(), which are written by the stored writer of
+    the compressor. Switching from one to the other ends the current stream.
+    Compressors without a stored writer compress everything.
+    """
+
+    def __init__(self, compressor, fileobj):
+        self._compressor = compressor
+        self._fileobj = fileobj
+        self._stream = None
+        self._stored = None
+        self._store_remaining = 0
+        self._size = 0
+
+    @staticmethod
+    def _close(stream, abort=False):
+        if isinstance(stream, (_PipeWriter, _XzStoredWriter,
+                               _GzipStoredWriter)):
+            stream.close(abort=abort)
+        else:
+            stream.close()
+
+    def store_next(self, size):
+        if self._compressor.stored is not None:
+            self._store_remaining = size
+
+    def write(self, data):
+        self._size += len(data)
+        view = memoryview(data)
+        while view:
+            if self._store_remaining:
+                if self._stream is not None:
+                    self._close(self._stream)
+                    self._stream = None
+                if self._stored is None:
+                    self._stored = self._compressor.stored(self._fileobj)
+                length = min(len(view), self._store_remaining)
+                self._stored.write(view[:length])
+                self._store_remaining -= length
+                view = view[length:]
+                if not self._store_remaining:
+                    self._close(self._stored)
+                    self._stored = None
+            else:
+                if self._stream is None:
+                    self._stream = self._compressor.open_stream(
+                        self._fileobj
+                    )
+                self._stream.write(view)
+                break
+        return len(data)
+
+    def tell(self):
+        return self._size
+
+    def close(self, abort=False):
+        for stream in (self._stored, self._stream):
+            if stream is not None:
+                self._close(stream, abort=abort)
+        self._stored = self._stream = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(abort=exc_type is not None)
+
+
+def _zstd_raw_frame(data):
+    """
+    Returns a zstd frame holding data in raw (not compressed) blocks.
+    """
+    header = struct.pack(
+        '<IBB',
+        ZSTD_FRAME_MAGIC,
+        # Frame_Header_Descriptor: no content size, no checksum, no dict
+        0,
+        ZSTD_RAW_WINDOW_DESCRIPTOR,
+    )
+    blocks = []
+    for offset in range(0, len(data), ZSTD_RAW_BLOCK_SIZE):
+        block = data[offset:offset + ZSTD_RAW_BLOCK_SIZE]
+        last = offset + ZSTD_RAW_BLOCK_SIZE >= len(data)
+        # Block_Size, Block_Type (raw: 0), Last_Block on 3 bytes
+        blocks.append(struct.pack('<I', len(block) << 3 | last)[:3])
+        blocks.append(block)
+    return header + b''.join(blocks)
+
+
+class _ZstdSeekableWriter(object):
+    """
+    Write-only file object producing a zstd seekable archive: the data is
+    cut into ZSTD_FRAME_SIZE chunks, each one compressed by its own zstd
+    process into an independent frame, and a seek table listing the frames
+    sizes is appended as a skippable frame.
+    Frames are compressed in parallel and written in order. Ranges
+    announced with store_next() go to frames of raw blocks instead.
+    """
+
+    def __init__(self, argv, threads, fileobj):
+        logging.debug("compressing zstd frames with(%s)" % argv)
+        self._argv = argv
+        self._fileobj = fileobj
+        self._buffer = bytearray()
+        self._stored = bytearray()
+        self._store_remaining = 0
+        self._size = 0
+        self._frames = []
+        self._pending = deque()
+        self._max_pending = threads + 1
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+
+    def _compress(self, data):
+        proc = subprocess.run(
+            self._argv,
+            input=data,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        if proc.returncode != 0:
+            raise Exception(
+                "%s failed(%s): %s" % (
+                    self._argv[0],
+                    proc.returncode,
+                    proc.stderr.decode("utf-8"),
+                )
+            )
+        return proc.stdout, len(data)
+
+    def _write_frame(self):
+        frame, size = self._pending.popleft().result()
+        self._fileobj.write(frame)
+        self._frames.append((len(frame), size))
+
+    def _submit(self, data):
+        self._pending.append(self._executor.submit(self._compress, data))
+        while len(self._pending) > self._max_pending:
+            self._write_frame()
+
+    def _submit_raw(self, data):
+        self._pending.append(_Done((_zstd_raw_frame(data), len(data))))
+        while len(self._pending) > self._max_pending:
+            self._write_frame()
+
+    def store_next(self, size):
+        if self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer = bytearray()
+        self._store_remaining = size
+
+    def write(self, data):
+        self._size += len(data)
+        view = memoryview(data)
+        if self._store_remaining:
+            length = min(len(view), self._store_remaining)
+            self._stored += view[:length]
+            self._store_remaining -= length
+            view = view[length:]
+            while len(self._stored) >= ZSTD_FRAME_SIZE:
+                self._submit_raw(bytes(self._stored[:ZSTD_FRAME_SIZE]))
+                del self._stored[:ZSTD_FRAME_SIZE]
+            if not self._store_remaining and self._stored:
+                self._submit_raw(bytes(self._stored))
+                self._stored = bytearray()
+        self._buffer += view
+        while len(self._buffer) >= ZSTD_FRAME_SIZE:
+            self._submit(bytes(self._buffer[:ZSTD_FRAME_SIZE]))
+            del self._buffer[:ZSTD_FRAME_SIZE]
+        return len(data)
+
+    def tell(self):
+        return self._size
+
+    def close(self, abort=False):
+        try:
+            if abort:
+                for future in self._pending:
+                    future.cancel()
+                return
+            if self._buffer:
+                self._submit(bytes(self._buffer))
+                self._buffer = bytearray()
+            while self._pending:
+                self._write_frame()
+            seek_table = b''.join(
+                struct.pack('<II', compressed, size)
+                for compressed, size in self._frames
+            ) + struct.pack(
+                # no per frame checksums
+                '<IBI', len(self._frames), 0, ZSTD_SEEKABLE_MAGIC
+            )
+            self._fileobj.write(
+                struct.pack('<II', ZSTD_SKIPPABLE_MAGIC, len(seek_table)) +
+                seek_table
+            )
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(abort=exc_type is not None)
+
+
+class Compressor(object):
+    """
+    An archive compression method. The external program, when found, is
+    preferred over the in-process module, which is single threaded.
+    """
+
+    def __init__(self, name, extension, argv=None, module=None,
+                 stored=None):
+        """
+        @param name: name used to select the compressor
+        @param extension: archive file extension, without the dot
+        @param argv: external compressor command line; '{threads}' is
+            replaced by the number of worker threads. Must compress stdin
+            to stdout.
+        @param module: callable wrapping a file object in an in-process
+            compressor
+        @param stored: callable wrapping a file object in a writer of
+            not compressed streams of the same format, if there is one
+        """
+        self.name = name
+        self.extension = extension
+        self._argv = argv
+        self._module = module
+        self.stored = stored
+        self.threads = 0
+
+    def _program(self):
+        if self._argv is None:
+            return None
+        return shutil.which(self._argv[0])
+
+    def available(self):
+        return self._program() is not None or self._module is not None
+
+    def open(self, fileobj):
+        """
+        Returns a write-only file object compressing into fileobj.
+        """
+        return _SegmentedWriter(self, fileobj)
+
+    def open_stream(self, fileobj):
+        """
+        Returns a write-only file object compressing into fileobj a single
+        stream.
+        """
+        program = self._program()
+        if program is not None:
+            threads = self.threads or os.cpu_count() or 1
+            return _PipeWriter(
+                [program] + [
+                    arg.format(threads=threads)
+                    for arg in self._argv[1:]
+                ],
+                fileobj,
+            )
+        return self._module(fileobj)
+
+    def __str__(self):
+        return self.name
+
+
+class SeekableZstdCompressor(Compressor):
+    """
+    zstd compressor emitting independently decompressible frames and a
+    seek table, so readers can start decompressing anywhere.
+    """
+
+    def open(self, fileobj):
+        threads = self.threads or os.cpu_count() or 1
+        return _ZstdSeekableWriter(
+            [self._program()] + self._argv[1:],
+            threads,
+            fileobj,
+        )
+
+
+# The lowest presets match what we used to run: xz -1 / bzip2 -1
+COMPRESSORS = dict(
+    (compressor.name, compressor) for compressor in (
+        Compressor(
+            'xz', 'xz',
+            argv=['xz', '-1', '-c', '-q', '-T{threads}'],
+            module=(
+                None if lzma is None
+                else lambda f: lzma.LZMAFile(f, 'w', preset=1)
+            ),
+            stored=_XzStoredWriter,
+        ),
+        SeekableZstdCompressor(
+            'zstd', 'zst',
+            argv=['zstd', '-3', '-c', '-q'],
+        ),
+        Compressor(
+            'pigz', 'gz',
+            argv=['pigz', '-1', '-c', '-p', '{threads}'],
+            stored=_GzipStoredWriter,
+        ),
+        Compressor(
+            'pbzip2', 'bz2',
+            argv=['pbzip2', '-1', '-c', '-p{threads}'],
+        ),
+        Compressor(
+            'bzip2', 'bz2',
+            module=lambda f: bz2.BZ2File(f, 'w', compresslevel=1),
+        ),
+    )
+)
+
+# Keep the historical xz, then bz2, archive formats when not told otherwise
+AUTO_ORDER = ('xz', 'pbzip2', 'bzip2')
+
+
+def get_compressor(name='auto', threads=0):
+    """
+    Returns the compressor registered as name, or the preferred available
+    one if name is 'auto'.
+    @param threads: worker threads for parallel compressors, 0 for one
+        per CPU
+    """
+    if name == 'auto':
+        candidates = AUTO_ORDER
+    else:
+        if name not in COMPRESSORS:
+            raise ValueError("Unknown compressor %s" % name)
+        candidates = (name,)
+    for candidate in candidates:
+        compressor = COMPRESSORS[candidate]
+        if compressor.available():
+            compressor = copy.copy(compressor)
+            compressor.threads = threads
+            return compressor
+        logging.debug('%s compression not available' % candidate)
+    raise ValueError("Compressor %s is not available" % name)
+
+
+class _StoreOnRead(object):
+    """
+    Wraps a member being added to the archive: once tarfile starts reading
+    its content, after having written its header, the next size bytes
+    written are announced as stored.
+    """
+
+    def __init__(self, fileobj, writer, size):
+        self._fileobj = fileobj
+        self._writer = writer
+        self._size = size
+
+    def read(self, size=-1):
+        if self._writer is not None:
+            self._writer.store_next(self._size)
+            self._writer = None
+        return self._fileobj.read(size)
+
+
+class _TarFile(tarfile.TarFile):
+
+    def addfile(self, tarinfo, fileobj=None):
+        if fileobj is None or tarinfo.size < STORE_MIN_SIZE:
+            super(_TarFile, self).addfile(tarinfo, fileobj)
+            return
+        # Large members, the reports, are traced
+        stored = _is_compressed(fileobj)
+        if stored:
+            logging.debug("already compressed member %s" % tarinfo.name)
+            fileobj = _StoreOnRead(fileobj, self.fileobj, tarinfo.size)
+        with tracing.span(
+            "add",
+            "archive",
+            member=tarinfo.name,
+            size=tarinfo.size,
+            stored=stored,
+        ):
+            super(_TarFile, self).addfile(tarinfo, fileobj)
+
+
+def create(path, directory, arcname, compressor):
+    """
+    Tar, compress and hash directory into path in a single pass.
+    @param path: destination of the compressed archive
+    @param directory: tree to archive
+    @param arcname: name of the top level directory inside the archive
+    @param compressor: a Compressor, see get_compressor
+    @return: the sha256 hex digest of the compressed archive
+    """
+    logging.debug(
+        "archiving %s into %s (%s)" % (directory, path, compressor)
+    )
+    fd = os.open(
+        path,
+        os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+        stat.S_IRUSR | stat.S_IWUSR
+    )
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            hashing = _HashingWriter(out)
+            with compressor.open(hashing) as compressed:
+                with _TarFile(fileobj=compressed, mode='w') as tar:
+                    tar.add(directory, arcname=arcname)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return hashing.hexdigest()
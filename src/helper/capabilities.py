@@ -0,0 +1,125 @@
+"""
+This module caches the sos plugins and plugin options available on the
+engine and each hypervisor, so they are not listed again, which takes
+seconds as sos loads every plugin, until the sos version installed there
+changes.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import threading
+
+
+def parse_plugins(output):
+    """
+    Returns the sets of plugins and of plugin options in output, the output
+    of sos report --list-plugins.
+    """
+    plugins = set()
+    options = set()
+    listing_options = False
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        if not line[0].isspace():
+            # A heading, such as "The following plugin options are
+            # available:"
+            listing_options = "option" in line
+            continue
+        name = line.split()[0]
+        if "." in name:
+            options.add(name)
+        elif not listing_options:
+            plugins.add(name)
+    return plugins, options
+
+
+class Cache(object):
+    """
+    The plugins and plugin options of hosts, by sos version, stored in
+    path. Entries are only written by save(). A Cache may be shared by
+    threads.
+    """
+
+    def __init__(self, path, entries=None):
+        self.path = path
+        self.entries = entries or {}
+        self._changed = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        """
+        Returns the Cache stored in path, empty if it can't be read.
+        """
+        try:
+            with open(path) as cache_file:
+                entries = json.load(cache_file)
+        except (IOError, ValueError) as e:
+            logging.debug("Cannot read capabilities cache %s: %s" % (path, e))
+            entries = {}
+        return cls(path, entries)
+
+    def version(self, host):
+        """
+        Returns the sos version of host when it was cached, None if it
+        wasn't.
+        """
+        return self.entries.get(host, {}).get("version")
+
+    def get(self, host, version):
+        """
+        Returns the plugins and plugin options of host, as parse_plugins
+        does, or None if they are not cached for its sos version.
+        """
+        entry = self.entries.get(host)
+        if not entry or entry["version"] != version:
+            return None
+        return set(entry["plugins"]), set(entry["options"])
+
+    def put(self, host, version, plugins, options):
+        entry = {
+            "version": version,
+            "plugins": sorted(plugins),
+            "options": sorted(options),
+        }
+        with self._lock:
+            self.entries[host] = entry
+            self._changed[host] = entry
+
+    def save(self):
+        """
+        Store the entries put, along with those stored meanwhile by
+        concurrent runs.
+        """
+        with self._lock:
+            if not self._changed:
+                return
+            directory = os.path.dirname(self.path)
+            if not os.path.exists(directory):
+                os.makedirs(directory, 0o700)
+            # Concurrent runs merge their entries one at a time
+            with open("%s.lock" % self.path, "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._merge(directory)
+            self._changed = {}
+
+    def _merge(self, directory):
+        try:
+            with open(self.path) as cache_file:
+                entries = json.load(cache_file)
+        except (IOError, ValueError):
+            entries = {}
+        entries.update(self._changed)
+        # Replace the cache atomically, concurrent runs may read it
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, "w") as cache_file:
+                json.dump(entries, cache_file)
+            os.rename(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
@@ -0,0 +1,145 @@
+"""
+This module keeps the checkpoint of a collection: a journal of the hosts
+collected and the phases completed, with the artifacts each of them left
+in the working directory, so an interrupted collection can be resumed by
+collecting only what is missing.
+
+The journal holds a JSON record per line, appended and synced to the disk
+as soon as a host or phase completes. A record cut short by a crash is
+ignored.
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+import threading
+
+
+class Checkpoint(object):
+    """
+    Journal of a collection, stored in path.
+    """
+
+    def __init__(self, path, records=()):
+        self.path = path
+        self.started = None
+        self.hosts = {}
+        self.phases = {}
+        self._lock = threading.Lock()
+        # A record cut short must not swallow the next one
+        self._newline = False
+        for record in records:
+            self._apply(record)
+
+    def _apply(self, record):
+        if "host" in record:
+            self.hosts[record["host"]] = record
+        elif "phase" in record:
+            self.phases[record["phase"]] = record
+        elif "started" in record:
+            self.started = record["started"]
+
+    @classmethod
+    def create(cls, path):
+        checkpoint = cls(path)
+        checkpoint._append({
+            "started": datetime.datetime.now().isoformat(),
+        })
+        return checkpoint
+
+    @classmethod
+    def load(cls, path):
+        """
+        Returns the Checkpoint stored in path.
+        """
+        records = []
+        with open(path) as journal:
+            data = journal.read()
+        for line in data.splitlines():
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                logging.debug("Ignoring checkpoint record %r" % line)
+        checkpoint = cls(path, records)
+        checkpoint._newline = bool(data) and not data.endswith("\n")
+        return checkpoint
+
+    def _append(self, record):
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            if self._newline:
+                line = "\n" + line
+                self._newline = False
+            with open(self.path, "a") as journal:
+                journal.write(line)
+                journal.flush()
+                os.fsync(journal.fileno())
+            self._apply(record)
+
+    def host_done(self, hostname, artifacts, **details):
+        """
+        Record that hostname was collected.
+        @param artifacts: the artifacts it left, see artifact()
+        @param details: what else is needed to resume, must be serializable
+            to JSON
+        """
+        details.update(host=hostname, artifacts=artifacts)
+        self._append(details)
+
+    def phase_done(self, phase, artifacts, **details):
+        """
+        Record that phase completed, see host_done.
+        """
+        details.update(phase=phase, artifacts=artifacts)
+        self._append(details)
+
+    def get_host(self, hostname, base):
+        """
+        Returns the record of hostname if it was collected and its
+        artifacts are still in base, None otherwise.
+        """
+        return self._verified(self.hosts.get(hostname), base)
+
+    def get_phase(self, phase, base):
+        """
+        Returns the record of phase if it completed and its artifacts are
+        still in base, None otherwise.
+        """
+        return self._verified(self.phases.get(phase), base)
+
+    @staticmethod
+    def _verified(record, base):
+        if record is None:
+            return None
+        for path, size, checksum in record["artifacts"]:
+            path = os.path.join(base, path)
+            if not os.path.exists(path):
+                logging.debug("Checkpoint artifact %s is missing" % path)
+                return None
+            if size is not None and os.path.getsize(path) != size:
+                logging.debug("Checkpoint artifact %s has changed" % path)
+                return None
+            if checksum is not None and _sha256(path) != checksum:
+                logging.debug("Checkpoint artifact %s is corrupted" % path)
+                return None
+        return record
+
+
+def _sha256(path):
+    checksum = hashlib.sha256()
+    with open(path, "rb") as artifact_file:
+        for block in iter(lambda: artifact_file.read(1 << 20), b""):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+def artifact(base, path, checksum=None):
+    """
+    Returns the description of path, relative to base, for the checkpoint:
+    its size, if it is a file, and its sha256 hex digest, if known. The
+    artifact must still match them for the checkpoint to be used.
+    """
+    size = os.path.getsize(path) if os.path.isfile(path) else None
+    return [os.path.relpath(path, base), size, checksum]
@@ -0,0 +1,171 @@
+"""
+This module adapts how many hypervisors are collected from at once, and
+limits the bandwidth used to transfer their reports.
+
+The adaptive limiter starts small and adjusts the limit in an AIMD fashion:
+while the engine keeps up, the limit grows by one each interval in which it
+was reached; when the load average, the write latency of the reports to the
+local disk or the throughput of the transfers shows congestion, the limit is
+halved.
+
+The bandwidth is limited by token buckets, one shared by all the hypervisors
+and optionally one for each of them.
+"""
+
+import asyncio
+import logging
+import os
+import time
+
+
+ADJUST_INTERVAL = 5.0
+INITIAL_LIMIT = 2
+
+# Congestion thresholds
+MAX_LOAD_PER_CPU = 1.5
+MAX_WRITE_SECONDS_PER_MIB = 0.05
+# Fraction of the best throughput per transfer seen below which the
+# transfers are considered stalled
+MIN_THROUGHPUT_RATIO = 0.5
+# Transfer time needed in an interval for its throughput to be meaningful
+MIN_TRANSFER_SECONDS = 1.0
+
+
+class AdaptiveLimiter(object):
+    """
+    Asynchronous context manager admitting up to limit tasks at once, like
+    asyncio.Semaphore, with limit adjusted between 1 and ceiling by run().
+    Like the asyncio primitives, must be created while its event loop is
+    the current one.
+    """
+
+    def __init__(self, ceiling, initial=INITIAL_LIMIT,
+                 interval=ADJUST_INTERVAL):
+        self.ceiling = max(1, ceiling)
+        self.limit = max(1, min(initial, self.ceiling))
+        self.interval = interval
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+        self._reset_window()
+        self._best_throughput = 0.0
+
+    def _reset_window(self):
+        self._saturated = self.in_flight >= self.limit
+        self._bytes = 0
+        self._write_seconds = 0.0
+        # id of each stream -> monotonic time of its first and last chunk
+        self._streams = {}
+
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(
+                lambda: self.in_flight < self.limit
+            )
+            self.in_flight += 1
+            if self.in_flight >= self.limit:
+                self._saturated = True
+
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def transferred(self, stream, nbytes, write_seconds):
+        """
+        Record nbytes of stream written to the local disk in write_seconds.
+        """
+        now = time.monotonic()
+        self._bytes += nbytes
+        self._write_seconds += write_seconds
+        self._streams.setdefault(id(stream), [now, now])[1] = now
+
+    def congestion(self):
+        """
+        Returns why the engine is congested, or None if it is not.
+        """
+        try:
+            load = os.getloadavg()[0] / (os.cpu_count() or 1)
+        except OSError:
+            load = 0.0
+        if load > MAX_LOAD_PER_CPU:
+            return "load average %.2f per cpu" % load
+
+        if not self._bytes:
+            return None
+        mib = self._bytes / float(1 << 20)
+        if self._write_seconds / mib > MAX_WRITE_SECONDS_PER_MIB:
+            return "disk writes taking %.3fs per MiB" % (
+                self._write_seconds / mib
+            )
+        seconds = sum(last - first for first, last in self._streams.values())
+        if seconds < MIN_TRANSFER_SECONDS:
+            return None
+        throughput = mib / seconds
+        self._best_throughput = max(self._best_throughput, throughput)
+        if throughput < self._best_throughput * MIN_THROUGHPUT_RATIO:
+            return "transfers slowed to %.1f MiB/s each" % throughput
+        return None
+
+    async def adjust(self):
+        reason = self.congestion()
+        previous = self.limit
+        if reason is not None:
+            self.limit = max(1, self.limit // 2)
+            # Past peaks may not be reachable at the new limit
+            self._best_throughput = 0.0
+        elif self._saturated:
+            self.limit = min(self.ceiling, self.limit + 1)
+        if self.limit != previous:
+            logging.debug(
+                "hypervisor concurrency %d -> %d (%s)" % (
+                    previous,
+                    self.limit,
+                    reason or "no congestion",
+                )
+            )
+            async with self._condition:
+                self._condition.notify_all()
+        self._reset_window()
+
+    async def run(self):
+        """
+        Adjust the limit every interval, until cancelled.
+        """
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.adjust()
+
+
+class TokenBucket(object):
+    """
+    Token bucket limiting the rate, in bytes per second, of the transfers
+    sharing it. Bursts are limited to one second worth of bytes.
+    """
+
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.tokens = self.rate
+        self.updated = time.monotonic()
+
+    def take(self, nbytes):
+        """
+        Take nbytes from the bucket, which may go into debt, and return how
+        many seconds to wait before the debt is paid off.
+        """
+        now = time.monotonic()
+        self.tokens = min(
+            self.rate,
+            self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+        self.tokens -= nbytes
+        return max(0.0, -self.tokens / self.rate)
+
+
+async def throttle(buckets, nbytes):
+    """
+    Wait until nbytes can be transferred within the rate of all buckets.
+    """
+    delay = max([bucket.take(nbytes) for bucket in buckets] or [0.0])
+    if delay > 0:
+        await asyncio.sleep(delay)
@@ -3,18 +3,55 @@ This module uses the REST API to get a collection of information about
 hypervisors
 """
 
+import fnmatch
 import logging
 import gettext
+import json
+import os
+import re
+import tempfile
+import time
 import ovirtsdk4
 
+from collections import deque
+from collections import namedtuple
+
 t = gettext.translation('hypervisors', fallback=True)
 _ = t.gettext
 
+PAGE_SIZE = 100
+
+# Embeds the cluster of each host, and the data center of that cluster,
+# in the host listing
+HOST_LINKS = 'cluster.data_center'
+
+# Cluster and data center names or patterns the engine search can match
+_SEARCH_NAME = re.compile(r'^[\w.*-]+$')
+
+
+class HostRecord(
+    namedtuple(
+        'HostRecord',
+        ('datacenter', 'cluster', 'address', 'is_spm', 'is_up'),
+    )
+):
+    """
+    A host as selected for collection: the name of its data center, its
+    ENGINETree.Cluster, its address and whether it is the SPM and up.
+    """
+    __slots__ = ()
+
 
 class ENGINETree(object):
+    """
+    Data centers, clusters and hosts of the engine, indexed by id for
+    joining them while they are added, and hosts by address for lookups.
+    """
 
     class DataCenter(object):
 
+        __slots__ = ('id', 'name', 'clusters')
+
         def __init__(self, id, name):
             self.id = id
             self.name = name
@@ -22,43 +59,104 @@ class ENGINETree(object):
 
         def add_cluster(self, cluster):
             self.clusters.add(cluster)
+            cluster.datacenter = self
+
+        def get_sortable(self):
+            return [
+                host.get_sortable()
+                for cluster in self.clusters
+                for host in cluster.hosts
+            ]
 
         def __str__(self):
             return self.name
 
     class Cluster(object):
 
+        __slots__ = ('id', 'name', 'hosts', 'gluster_enabled', 'datacenter')
+
         def __init__(self, id, name, gluster_enabled=False):
             self.id = id
             self.name = name
             self.hosts = set()
             self.gluster_enabled = gluster_enabled
+            self.datacenter = None
 
         def add_host(self, host):
             self.hosts.add(host)
+            host.cluster = self
+
+        def get_sortable(self):
+            return [host.get_sortable() for host in self.hosts]
 
         def __str__(self):
             return self.name
 
     class Host(object):
 
+        __slots__ = ('address', 'name', 'is_spm', 'is_up', 'cluster', 'record')
+
         def __init__(self, address, name=None, is_spm=False, is_up=False):
             self.address = address
             self.name = name
             self.is_spm = is_spm
             self.is_up = is_up
+            self.cluster = None
+            self.record = None
+
+        def get_sortable(self):
+            # Built once, the same record is shared by every set of hosts
+            if self.record is None:
+                self.record = HostRecord(
+                    self.cluster.datacenter.name,
+                    self.cluster,
+                    self.address,
+                    self.is_spm,
+                    self.is_up,
+                )
+            return self.record
 
         def __str__(self):
             return self.address
 
     def __init__(self):
-        self.datacenters = set()
-        self.clusters = set()
+        self.datacenters = {}
+        self.clusters = {}
         self.hosts = set()
+        self._hosts_by_address = {}
+
+    def _add_datacenter(self, dc_obj):
+        self.datacenters[dc_obj.id] = dc_obj
+
+    def _add_cluster(self, c_obj, datacenter_id):
+        """
+        Add a cluster to the data center with datacenter_id, "" stands for
+        no data center.
+        """
+        self.clusters[c_obj.id] = c_obj
+        if datacenter_id == "" and "" not in self.datacenters:
+            self._add_datacenter(self.DataCenter("", ""))
+        dc = self.datacenters.get(datacenter_id)
+        if dc is not None:
+            dc.add_cluster(c_obj)
+
+    def _add_host(self, host_obj, cluster_id):
+        """
+        Add a host to the cluster with cluster_id, "" stands for no cluster.
+        """
+        self.hosts.add(host_obj)
+        if cluster_id == "" and "" not in self.clusters:
+            self._add_cluster(self.Cluster("", ""), "")
+        cluster = self.clusters.get(cluster_id)
+        if cluster is not None:
+            cluster.add_host(host_obj)
+            if cluster.datacenter is not None:
+                self._hosts_by_address[host_obj.address] = host_obj
 
     def add_datacenter(self, datacenter):
-        dc_obj = self.DataCenter(datacenter.id, datacenter.name)
-        self.datacenters.add(dc_obj)
+        self._add_datacenter(
+            self.DataCenter(datacenter.id, datacenter.name)
+        )
 
     def add_cluster(self, cluster):
         c_obj = self.Cluster(
@@ -66,65 +164,134 @@ class ENGINETree(object):
             cluster.name,
             cluster.gluster_service
         )
-        self.clusters.add(c_obj)
         if cluster.data_center is not None:
-            for dc in self.datacenters:
-                if dc.id == cluster.data_center.id:
-                    dc.add_cluster(c_obj)
+            self._add_cluster(c_obj, cluster.data_center.id)
         else:
-            dummySeen = 0
-            for dc in self.datacenters:
-                if dc.id == "":
-                    dc.add_cluster(c_obj)
-                    dummySeen = 1
-            if dummySeen == 0:
-                dc = self.DataCenter("", "")
-                dc.add_cluster(c_obj)
-                self.datacenters.add(dc)
+            self._add_cluster(c_obj, "")
 
     def add_host(self, host):
         is_spm = host.spm.status == ovirtsdk4.types.SpmStatus.SPM
         is_up = host.status == ovirtsdk4.types.HostStatus.UP
         host_obj = self.Host(host.address, host.name, is_spm, is_up)
-        self.hosts.add(host_obj)
         if host.cluster is not None:
-            for cluster in self.clusters:
-                if cluster.id == host.cluster.id:
-                    cluster.add_host(host_obj)
+            self._add_host(host_obj, host.cluster.id)
         else:
-            dummySeen = 0
-            for cluster in self.clusters:
-                if cluster.id == "":
-                    cluster.add_host(host_obj)
-                    dummySeen = 1
-            if dummySeen == 0:
-                c_obj = self.Cluster("", "")
-                c_obj.add_host(host_obj)
-                self.clusters.add(c_obj)
-                dc = self.DataCenter("", "")
-                dc.add_cluster(c_obj)
-                self.datacenters.add(dc)
+            self._add_host(host_obj, "")
+
+    def add_linked_host(self, host):
+        """
+        Add a host listed with its cluster and data center embedded, adding
+        them as well the first time they are seen.
+        """
+        cluster = host.cluster
+        if cluster is not None and cluster.id not in self.clusters:
+            datacenter = cluster.data_center
+            if (
+                datacenter is not None and
+                datacenter.id not in self.datacenters
+            ):
+                self.add_datacenter(datacenter)
+            self.add_cluster(cluster)
+        self.add_host(host)
+
+    def add_sortable(self, dc, cluster, address, is_spm=False, is_up=False):
+        """
+        Add a host as in a HostRecord, with the cluster given as
+        (id, name, gluster_enabled). Data centers are keyed by name.
+        """
+        if dc not in self.datacenters:
+            self._add_datacenter(self.DataCenter(dc, dc))
+        cluster_id = cluster[0]
+        if cluster_id not in self.clusters:
+            self._add_cluster(self.Cluster(*cluster), dc)
+        self._add_host(self.Host(address, None, is_spm, is_up), cluster_id)
+
+    def get_host(self, address):
+        return self._hosts_by_address.get(address)
 
     def __str__(self):
         return "\n".join([
             "%-20s | %-20s | %s" % (dc, cluster, host)
-            for dc in self.datacenters
+            for dc in self.datacenters.values()
             for cluster in dc.clusters
             for host in cluster.hosts
         ])
 
     def get_sortable(self):
+        """
+        Returns a HostRecord for each host of the tree.
+        """
         return [
-            (dc.name, cluster, host.address, host.is_spm, host.is_up)
-            for dc in self.datacenters
-            for cluster in dc.clusters
-            for host in cluster.hosts
+            host
+            for dc in self.datacenters.values()
+            for host in dc.get_sortable()
         ]
 
 
-def _initialize_api(hostname, username, password, ca, insecure, kerberos):
+class HostFilter(object):
+    """
+    Selects the hosts of an ENGINETree by the names of their data center and
+    cluster and by their address. Each of them is given as a collection of
+    names or shell-style patterns, of which any must match; None lets
+    anything through. The patterns of each kind are compiled into a single
+    regular expression, and the tree is walked once, skipping the data
+    centers and clusters that don't match.
+    """
+
+    # Characters making a name a pattern, as for LogCollector._sift_patterns
+    PATTERN_CHARS = ('*', '[', ']', '?')
+
+    def __init__(self, datacenters=None, clusters=None, hosts=None):
+        self.datacenter = self._compile(datacenters)
+        self.cluster = self._compile(clusters)
+        self.host = self._compile(hosts)
+
+    @classmethod
+    def _compile(cls, patterns):
+        """
+        Returns a function telling whether a name matches any of patterns,
+        or None if patterns is None.
+        """
+        if patterns is None:
+            return None
+        names = set()
+        regexes = []
+        for pattern in patterns:
+            if any(c in pattern for c in cls.PATTERN_CHARS):
+                regexes.append(fnmatch.translate(pattern))
+            else:
+                names.add(pattern)
+        if not regexes:
+            return names.__contains__
+        match = re.compile(
+            "|".join("(?:%s)" % regex for regex in regexes)
+        ).match
+
+        def matches(name):
+            return name in names or match(name) is not None
+        return matches
+
+    def select(self, tree):
+        """
+        Yields the HostRecord of each host of tree passing the filter.
+        """
+        for dc in tree.datacenters.values():
+            if self.datacenter is not None and not self.datacenter(dc.name):
+                continue
+            for cluster in dc.clusters:
+                if self.cluster is not None and not self.cluster(cluster.name):
+                    continue
+                for host in cluster.hosts:
+                    if self.host is None or self.host(host.address):
+                        yield host.get_sortable()
+
+
+def _initialize_api(hostname, username, password, ca, insecure, kerberos,
+                    connections=0):
     """
     Initialize the oVirt RESTful API
+    @param connections: maximum number of parallel connections to the
+        engine, 0 for no limit
     """
     url = 'https://{hostname}/ovirt-engine/api'.format(
         hostname=hostname,
@@ -135,7 +302,8 @@ def _initialize_api(hostname, username, password, ca, insecure, kerberos):
                                 password=password,
                                 ca_file=ca,
                                 insecure=insecure,
-                                kerberos=kerberos)
+                                kerberos=kerberos,
+                                connections=connections)
     svc = conn.system_service().get()
     pi = svc.product_info
     if pi is not None:
@@ -152,42 +320,180 @@ def _initialize_api(hostname, username, password, ca, insecure, kerberos):
     return conn
 
 
-def paginate(entity, oquery=""):
+def paginate(entity, oquery="", **kwargs):
     """Generator for listing all elements of object avoiding api query limit
     @param entity: object to paginate using list and query
     @param oquery: optional query to limit results
+    @param kwargs: further parameters of the list request
     """
     page = 0
-    page_size = 100
+    page_size = PAGE_SIZE
     length = page_size
     while length > 0:
         page += 1
         query = "%s page %s" % (oquery, page)
         # after BZ1025320 default is provide all results
         # this limits results on each iteration to page_size
-        tanda = entity.list(search=query, max=page_size)
+        tanda = entity.list(search=query, max=page_size, **kwargs)
         length = len(tanda)
         for elem in tanda:
             yield elem
 
 
-def get_all(hostname, username, password, ca, insecure=False, kerberos=False):
+class _Pager(object):
+    """
+    Keeps up to in_flight page requests of an entity pending, until a page
+    shorter than PAGE_SIZE shows the end of the collection.
+    """
+
+    def __init__(self, entity, oquery, in_flight, kwargs):
+        self.entity = entity
+        self.oquery = oquery
+        self.in_flight = in_flight
+        self.kwargs = kwargs
+        self.page = 0
+        self.pending = deque()
+        self.done = False
+        self.elements = []
+
+    def fill(self):
+        while not self.done and len(self.pending) < self.in_flight:
+            self.page += 1
+            self.pending.append(
+                self.entity.list(
+                    search="%s page %s" % (self.oquery, self.page),
+                    max=PAGE_SIZE,
+                    wait=False,
+                    **self.kwargs
+                )
+            )
+
+    def step(self):
+        """
+        Wait for the oldest pending page, pages are consumed in order.
+        """
+        tanda = self.pending.popleft().wait()
+        self.elements.extend(tanda)
+        if len(tanda) < PAGE_SIZE:
+            self.done = True
+        self.fill()
+
+
+def paginate_concurrent(entities, oquery="", in_flight=4, **kwargs):
+    """Lists all elements of several objects at once avoiding api query
+    limit, with up to in_flight page requests pending for each object
+    @param entities: objects to paginate using list and query
+    @param oquery: optional query to limit results
+    @param kwargs: further parameters of the list requests
+    @return: a list of elements for each object
+    """
+    pagers = [
+        _Pager(entity, oquery, in_flight, kwargs) for entity in entities
+    ]
+    for pager in pagers:
+        pager.fill()
+    while any(pager.pending for pager in pagers):
+        for pager in pagers:
+            if pager.pending:
+                # Requests sent before the end was seen are still consumed
+                pager.step()
+    return [pager.elements for pager in pagers]
+
+
+def search_query(clusters=None, datacenters=None):
+    """
+    Returns an engine search query for the hosts of the clusters and data
+    centers matching the given names or patterns, or "" when they cannot be
+    expressed as one. Only the * wildcard is understood by the engine, and
+    the hosts found still need to be filtered locally.
+    """
+    clusters = clusters or []
+    datacenters = datacenters or []
+    if not all(_SEARCH_NAME.match(name) for name in clusters + datacenters):
+        return ""
+    # The engine search has no grouping, "or" only works on its own
+    if clusters and datacenters and len(clusters) + len(datacenters) > 2:
+        return ""
+    terms = ["cluster = %s" % name for name in clusters]
+    terms.extend("datacenter = %s" % name for name in datacenters)
+    return (" and " if clusters and datacenters else " or ").join(terms)
+
+
+def _get_linked_hosts(api, oquery, concurrency):
+    """
+    Lists the hosts matching oquery with their cluster and data center
+    embedded, returns None if the engine did not embed them.
+    """
+    if concurrency > 1:
+        hosts, = paginate_concurrent(
+            [api.hosts_service()],
+            oquery,
+            in_flight=concurrency,
+            follow=HOST_LINKS,
+        )
+    else:
+        hosts = list(paginate(api.hosts_service(), oquery, follow=HOST_LINKS))
+    if any(
+        host.cluster is not None and host.cluster.name is None
+        for host in hosts
+    ):
+        return None
+    return hosts
+
+
+def get_all(hostname, username, password, ca, insecure=False, kerberos=False,
+            concurrency=1, oquery=""):
+    """
+    @param concurrency: maximum number of page requests pending at once for
+        each collection; 1 fetches them one page at a time
+    @param oquery: optional search query to limit the hosts returned, see
+        search_query
+    @return: an ENGINETree of the hosts
+    """
 
     tree = ENGINETree()
-    result = set()
     conn = None
     try:
         conn = _initialize_api(hostname, username, password, ca, insecure,
-                               kerberos)
+                               kerberos,
+                               connections=3 * concurrency)
         api = conn.system_service()
+        hosts = None
         if api is not None:
+            try:
+                hosts = _get_linked_hosts(api, oquery, concurrency)
+            except ovirtsdk4.Error as e:
+                logging.debug("Cannot list hosts with links: %s" % e)
+            if hosts is None:
+                # Older engines, the hosts are filtered by the caller
+                logging.debug(
+                    "Listing data centers, clusters and hosts separately"
+                )
+        if hosts is not None:
+            for host in hosts:
+                tree.add_linked_host(host)
+        elif api is not None and concurrency > 1:
+            datacenters, clusters, hosts = paginate_concurrent(
+                [
+                    api.data_centers_service(),
+                    api.clusters_service(),
+                    api.hosts_service(),
+                ],
+                in_flight=concurrency,
+            )
+            for dc in datacenters:
+                tree.add_datacenter(dc)
+            for cluster in clusters:
+                tree.add_cluster(cluster)
+            for host in hosts:
+                tree.add_host(host)
+        elif api is not None:
             for dc in paginate(api.data_centers_service()):
                 tree.add_datacenter(dc)
             for cluster in paginate(api.clusters_service()):
                 tree.add_cluster(cluster)
             for host in paginate(api.hosts_service()):
                 tree.add_host(host)
-            result = set(tree.get_sortable())
     except Exception as e:
         # ovirt-engine-sdk4 does not provides specialized exceptions
         # anymore. this bad exception is all we can have for now.
@@ -201,4 +507,71 @@ def get_all(hostname, username, password, ca, insecure=False, kerberos=False):
     finally:
         if conn is not None:
             conn.close()
-    return result
+    return tree
+
+
+def load_cache(path, engine, ttl):
+    """
+    Returns an ENGINETree of the hosts of engine stored by save_cache in
+    path and their age in seconds, or (None, None) if there are none or
+    they are older than ttl seconds.
+    """
+    try:
+        with open(path) as cache_file:
+            entry = json.load(cache_file).get(engine)
+    except (IOError, ValueError) as e:
+        logging.debug("Cannot read inventory cache %s: %s" % (path, e))
+        return None, None
+    if not entry:
+        return None, None
+    age = time.time() - entry["time"]
+    if age < 0 or age > ttl:
+        logging.debug("Inventory cache for %s expired" % engine)
+        return None, None
+
+    tree = ENGINETree()
+    for host in entry["hosts"]:
+        tree.add_sortable(*host)
+    logging.debug(
+        "Loaded %d hosts of %s from inventory cache (%ds old)" % (
+            len(tree.hosts), engine, age
+        )
+    )
+    return tree, age
+
+
+def save_cache(path, engine, tree):
+    """
+    Store the hosts of the ENGINETree returned by get_all for engine in
+    path.
+    """
+    try:
+        with open(path) as cache_file:
+            cache = json.load(cache_file)
+    except (IOError, ValueError):
+        cache = {}
+    cache[engine] = {
+        "time": time.time(),
+        "hosts": [
+            (
+                dc,
+                (cluster.id, cluster.name, cluster.gluster_enabled),
+                address,
+                is_spm,
+                is_up,
+            )
+            for dc, cluster, address, is_spm, is_up in tree.get_sortable()
+        ],
+    }
+    directory = os.path.dirname(path)
+    if not os.path.exists(directory):
+        os.makedirs(directory, 0o700)
+    # Replace the cache atomically, concurrent runs may read it
+    fd, tmp_path = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(fd, "w") as cache_file:
+            json.dump(cache, cache_file)
+        os.rename(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
@@ -0,0 +1,218 @@
+"""
+This module reports the progress of the collection from the hypervisors:
+how many are done, in flight and queued, the phase each one is in, the
+bytes transferred, the throughput and an estimate of the time left.
+
+On a terminal the report is a view redrawn in place every second, otherwise
+a summary line is logged every PROGRESS_INTERVAL seconds.
+"""
+
+import asyncio
+import datetime
+import logging
+import sys
+import threading
+import time
+
+
+LIVE_INTERVAL = 1.0
+PROGRESS_INTERVAL = 30.0
+# In flight hosts shown by the live view, slowest first
+LIVE_MAX_HOSTS = 10
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+TIMED_OUT = "timed out"
+
+
+def _format_bytes(nbytes):
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if nbytes < 1024:
+            return "%.1f %s" % (nbytes, unit)
+        nbytes /= 1024.0
+    return "%.1f TiB" % nbytes
+
+
+def _format_seconds(seconds):
+    return str(datetime.timedelta(seconds=int(seconds)))
+
+
+class HostProgress(object):
+    """
+    Progress of the collection from a single host.
+    """
+
+    def __init__(self, hostname):
+        self.hostname = hostname
+        self.state = QUEUED
+        self.phase = None
+        self.started = None
+        self.finished = None
+        self.bytes = 0
+
+    def start(self):
+        self.state = RUNNING
+        self.phase = "starting"
+        self.started = time.monotonic()
+
+    def set_phase(self, phase):
+        self.phase = phase
+
+    def transferred(self, stream, nbytes, write_seconds):
+        """
+        Same interface as concurrency.AdaptiveLimiter.transferred, to be
+        passed as a monitor to AsyncCaller.stream.
+        """
+        self.bytes += nbytes
+
+    def finish(self, state=DONE):
+        self.state = state
+        self.phase = None
+        self.finished = time.monotonic()
+
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+
+class _ClearLiveView(logging.Filter):
+    """
+    Clears the live view before a log record is written to the terminal,
+    it is drawn again below the record.
+    """
+
+    def __init__(self, view):
+        super(_ClearLiveView, self).__init__()
+        self.view = view
+
+    def filter(self, record):
+        self.view.clear()
+        return True
+
+
+class Progress(object):
+    """
+    Progress of the collection from a set of hosts.
+    @param live: redraw a view of the progress in place on stream, which
+        must be a terminal, instead of logging summary lines
+    """
+
+    def __init__(self, live=False, stream=sys.stdout):
+        self.hosts = []
+        self.live = live
+        self.stream = stream
+        self.started = time.monotonic()
+        self._lines = 0
+        self._lock = threading.Lock()
+        self._filters = []
+
+    def add(self, hostname):
+        host = HostProgress(hostname)
+        self.hosts.append(host)
+        return host
+
+    def count(self, *states):
+        return sum(1 for host in self.hosts if host.state in states)
+
+    def summary(self):
+        done = self.count(DONE, FAILED, TIMED_OUT)
+        running = [host for host in self.hosts if host.state == RUNNING]
+        phases = {}
+        for host in running:
+            phases[host.phase] = phases.get(host.phase, 0) + 1
+        elapsed = time.monotonic() - self.started
+        transferred = sum(host.bytes for host in self.hosts)
+
+        parts = [
+            "%d/%d hosts done" % (done, len(self.hosts)),
+        ]
+        failed = self.count(FAILED, TIMED_OUT)
+        if failed:
+            parts[0] += " (%d failed)" % failed
+        in_flight = "%d in flight" % len(running)
+        if phases:
+            in_flight += " (%s)" % ", ".join(
+                "%s %d" % (phase, count)
+                for phase, count in sorted(phases.items(), key=str)
+            )
+        parts.append(in_flight)
+        parts.append("%d queued" % self.count(QUEUED))
+        parts.append(
+            "%s at %s/s" % (
+                _format_bytes(transferred),
+                _format_bytes(transferred / elapsed if elapsed else 0),
+            )
+        )
+        if 0 < done < len(self.hosts):
+            parts.append(
+                "ETA %s" % _format_seconds(
+                    elapsed / done * (len(self.hosts) - done)
+                )
+            )
+        parts.append("elapsed %s" % _format_seconds(elapsed))
+        return ", ".join(parts)
+
+    def _view(self):
+        lines = [self.summary()]
+        running = sorted(
+            (host for host in self.hosts if host.state == RUNNING),
+            key=HostProgress.elapsed,
+            reverse=True,
+        )
+        for host in running[:LIVE_MAX_HOSTS]:
+            lines.append(
+                "  %-30s %-10s %10s %12s" % (
+                    host.hostname,
+                    host.phase or "",
+                    _format_seconds(host.elapsed()),
+                    _format_bytes(host.bytes),
+                )
+            )
+        if len(running) > LIVE_MAX_HOSTS:
+            lines.append("  ... %d more" % (len(running) - LIVE_MAX_HOSTS))
+        return lines
+
+    def clear(self):
+        with self._lock:
+            if self._lines:
+                # Back to the first line of the view and erase down
+                self.stream.write("\033[%dF\033[J" % self._lines)
+                self.stream.flush()
+                self._lines = 0
+
+    def draw(self):
+        lines = self._view()
+        self.clear()
+        with self._lock:
+            self.stream.write("\n".join(lines) + "\n")
+            self.stream.flush()
+            self._lines = len(lines)
+
+    async def run(self):
+        """
+        Report the progress periodically, until cancelled.
+        """
+        if self.live:
+            # Log records sent to the terminal would be mixed with the view
+            for handler in logging.root.handlers:
+                stream = getattr(handler, "stream", None)
+                if stream is not None and stream.isatty():
+                    log_filter = _ClearLiveView(self)
+                    handler.addFilter(log_filter)
+                    self._filters.append((handler, log_filter))
+        try:
+            while True:
+                if self.live:
+                    self.draw()
+                    await asyncio.sleep(LIVE_INTERVAL)
+                else:
+                    await asyncio.sleep(PROGRESS_INTERVAL)
+                    logging.info("Progress: %s" % self.summary())
+        finally:
+            for handler, log_filter in self._filters:
+                handler.removeFilter(log_filter)
+            self._filters = []
+            self.clear()
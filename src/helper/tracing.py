@@ -0,0 +1,126 @@
+"""
+This module records how long each step of a collection takes, as spans
+written in the Chrome trace event format, which chrome://tracing and
+Perfetto (https://ui.perfetto.dev) can display.
+
+Spans are shown on tracks: by default the thread recording them, or the
+track given, e.g. the hypervisor a coroutine is collecting from.
+"""
+
+import contextlib
+import datetime
+import json
+import os
+import stat
+import threading
+import time
+
+
+PROCESS_NAME = "ovirt-log-collector"
+
+
+class Tracer(object):
+    """
+    Collects the spans of a run. Spans can be recorded from any thread.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.wall_started = datetime.datetime.now()
+        self.events = []
+        self._tracks = {}
+        self._lock = threading.Lock()
+
+    def _now(self):
+        # Trace timestamps are in microseconds
+        return (time.monotonic() - self.started) * 1e6
+
+    def _track_id(self, track):
+        with self._lock:
+            if track not in self._tracks:
+                self._tracks[track] = len(self._tracks) + 1
+            return self._tracks[track]
+
+    @contextlib.contextmanager
+    def span(self, name, category="collect", track=None, **args):
+        """
+        Context manager recording a span named name around its body, giving
+        the dict of its details so more can be added while it runs.
+        @param track: name of the track to show the span on, the name of the
+            current thread if None
+        @param args: details shown with the span; the class of the exception
+            ending the span, if any, is added as error
+        """
+        if track is None:
+            track = threading.current_thread().name
+        started = self._now()
+        try:
+            yield args
+        except BaseException as e:
+            args["error"] = type(e).__name__
+            raise
+        finally:
+            self.events.append({
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": started,
+                "dur": self._now() - started,
+                "pid": os.getpid(),
+                "tid": self._track_id(track),
+                "args": args,
+            })
+
+    def to_json(self):
+        pid = os.getpid()
+        metadata = [{
+            "name": "process_name",
+            "ph": "M",
+            "pid": pid,
+            "args": {"name": PROCESS_NAME},
+        }]
+        with self._lock:
+            tracks = list(self._tracks.items())
+        for track, tid in tracks:
+            metadata.append({
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": tid,
+                "args": {"name": str(track)},
+            })
+        return {
+            "traceEvents": metadata + list(self.events),
+            "displayTimeUnit": "ms",
+            "otherData": {
+                "started": self.wall_started.isoformat(),
+            },
+        }
+
+    def write(self, path):
+        """
+        Write the spans recorded so far to path, only readable by the user
+        as they name the hosts.
+        """
+        fd = os.open(
+            path,
+            os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+            stat.S_IRUSR | stat.S_IWUSR
+        )
+        with os.fdopen(fd, "w") as trace:
+            json.dump(self.to_json(), trace)
+
+
+# The tracer of this run
+tracer = Tracer()
+
+
+def span(name, category="collect", track=None, **args):
+    """
+    Record a span with the tracer of this run, see Tracer.span.
+    """
+    return tracer.span(name, category, track, **args)
+
+
+def write(path):
+    tracer.write(path)
@@ -0,0 +1,355 @@
+#!/usr/bin/python3
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import bz2
+import gzip
+import hashlib
+import io
+import lzma
+import os
+import shutil
+import struct
+import subprocess
+import tarfile
+import tempfile
+import unittest
+
+from unittest import mock
+
+from ovirt_log_collector.helper import archive
+
+
+def noise(seed, size):
+    """Returns size bytes that don't compress, always the same for seed."""
+    return hashlib.shake_256(seed.encode("utf-8")).digest(size)
+
+
+def text(size):
+    lines = b"".join(b"line %d of a log file\n" % i for i in range(1000))
+    return (lines * (size // len(lines) + 1))[:size]
+
+
+# Members of the archived tree, by path
+MEMBERS = {
+    "small.log": text(1000),
+    "empty.log": b"",
+    "logs/large.log": text(archive.STORE_MIN_SIZE + 12345),
+    "logs/threshold.log": text(archive.STORE_MIN_SIZE),
+    "noise.bin": noise("noise", archive.STORE_MIN_SIZE + 1),
+    # Already compressed, stored from STORE_MIN_SIZE on
+    "reports/host1.tar.xz": lzma.compress(
+        noise("host1", 3 * archive.STORE_MIN_SIZE), preset=0
+    ),
+    "reports/host2.tar.gz": gzip.compress(
+        noise("host2", archive.STORE_MIN_SIZE + 54321), compresslevel=1
+    ),
+    "reports/small.tar.xz": lzma.compress(noise("small", 1000)),
+    "reports/host3.tar.bz2": bz2.compress(
+        noise("host3", archive.STORE_MIN_SIZE * 2), compresslevel=1
+    ),
+}
+
+
+def program(name):
+    return shutil.which(name) is not None
+
+
+class ArchiveTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.tree = os.path.join(self.tmp, "tree")
+        for path, content in MEMBERS.items():
+            path = os.path.join(self.tree, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as member:
+                member.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def create(self, compressor):
+        path = os.path.join(self.tmp, "archive.tar.%s" % compressor.extension)
+        checksum = archive.create(path, self.tree, "collected", compressor)
+        with open(path, "rb") as created:
+            self.assertEqual(
+                checksum,
+                hashlib.sha256(created.read()).hexdigest()
+            )
+        return path
+
+    def assertMembers(self, tar):
+        extracted = os.path.join(self.tmp, "extracted")
+        tar.extractall(extracted)
+        for path, content in MEMBERS.items():
+            with open(
+                os.path.join(extracted, "collected", path),
+                "rb"
+            ) as member:
+                self.assertEqual(member.read(), content, path)
+
+    def assertTested(self, argv, path):
+        proc = subprocess.run(
+            argv + [path],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        self.assertEqual(proc.returncode, 0, proc.stderr)
+
+
+class CreateTest(ArchiveTestCase):
+
+    def round_trip(self, compressor):
+        path = self.create(compressor)
+        with tarfile.open(path) as tar:
+            self.assertMembers(tar)
+        return path
+
+    @unittest.skipUnless(program("xz"), "xz is not installed")
+    def test_xz(self):
+        path = self.round_trip(archive.get_compressor("xz", threads=2))
+        self.assertTested(["xz", "-t"], path)
+
+    def test_xz_module(self):
+        compressor = archive.Compressor(
+            "xz", "xz",
+            module=lambda f: lzma.LZMAFile(f, "w", preset=1),
+            stored=archive.COMPRESSORS["xz"].stored,
+        )
+        path = self.round_trip(compressor)
+        if program("xz"):
+            self.assertTested(["xz", "-t"], path)
+
+    def test_bzip2(self):
+        path = self.round_trip(archive.get_compressor("bzip2"))
+        if program("bzip2"):
+            self.assertTested(["bzip2", "-t"], path)
+
+
+@unittest.skipUnless(program("zstd"), "zstd is not installed")
+class ZstdSeekableTest(ArchiveTestCase):
+
+    def decompress(self, data):
+        proc = subprocess.run(
+            ["zstd", "-d", "-c", "-q"],
+            input=data,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        self.assertEqual(proc.returncode, 0, proc.stderr)
+        return proc.stdout
+
+    def seek_table(self, data):
+        """Returns the (compressed, decompressed) sizes of the frames."""
+        count, descriptor, magic = struct.unpack("<IBI", data[-9:])
+        self.assertEqual(magic, archive.ZSTD_SEEKABLE_MAGIC)
+        self.assertEqual(descriptor, 0)
+        table_size = 8 * count + 9
+        skippable = len(data) - table_size - 8
+        self.assertEqual(
+            struct.unpack("<II", data[skippable:skippable + 8]),
+            (archive.ZSTD_SKIPPABLE_MAGIC, table_size)
+        )
+        frames = [
+            struct.unpack("<II", data[offset:offset + 8])
+            for offset in range(skippable + 8, len(data) - 9, 8)
+        ]
+        self.assertEqual(len(frames), count)
+        self.assertEqual(sum(size for size, _ in frames), skippable)
+        return frames
+
+    # Odd sized frames, so they cut members, blocks and tar records
+    @mock.patch.object(archive, "ZSTD_FRAME_SIZE", (1 << 20) + 4097)
+    def test_round_trip(self):
+        path = self.create(archive.get_compressor("zstd", threads=2))
+        self.assertTested(["zstd", "-t", "-q"], path)
+        with open(path, "rb") as created:
+            data = created.read()
+        tar = self.decompress(data)
+        with tarfile.open(fileobj=io.BytesIO(tar)) as extracted:
+            self.assertMembers(extracted)
+
+        frames = self.seek_table(data)
+        self.assertGreater(len(frames), 1)
+        self.assertEqual(sum(size for _, size in frames), len(tar))
+        offset = 0
+        position = 0
+        raw_frames = 0
+        for compressed, size in frames:
+            self.assertLessEqual(size, archive.ZSTD_FRAME_SIZE)
+            # Each frame is decompressed on its own
+            frame = self.decompress(data[offset:offset + compressed])
+            self.assertEqual(frame, tar[position:position + size])
+            if compressed > size:
+                raw_frames += 1
+            offset += compressed
+            position += size
+        # The already compressed members went to raw frames
+        self.assertGreater(raw_frames, 0)
+
+    def test_single_frame(self):
+        shutil.rmtree(self.tree)
+        os.makedirs(self.tree)
+        with open(os.path.join(self.tree, "small.log"), "wb") as member:
+            member.write(MEMBERS["small.log"])
+        path = self.create(archive.get_compressor("zstd", threads=1))
+        self.assertTested(["zstd", "-t", "-q"], path)
+        with open(path, "rb") as created:
+            data = created.read()
+        frames = self.seek_table(data)
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(frames[0][1], len(self.decompress(data)))
+
+
+class StoredTest(ArchiveTestCase):
+    """
+    Already compressed members are written as not compressed streams of
+    the archive format, whose framing is written by hand.
+    """
+
+    # Around the xz chunk and zstd block sizes
+    SIZES = (
+        1,
+        archive.XZ_UNCOMPRESSED_CHUNK_SIZE - 1,
+        archive.XZ_UNCOMPRESSED_CHUNK_SIZE,
+        archive.XZ_UNCOMPRESSED_CHUNK_SIZE + 1,
+        archive.ZSTD_RAW_BLOCK_SIZE - 1,
+        archive.ZSTD_RAW_BLOCK_SIZE,
+        archive.ZSTD_RAW_BLOCK_SIZE + 1,
+        3 * archive.ZSTD_RAW_BLOCK_SIZE,
+        archive.STORE_MIN_SIZE + 7,
+    )
+
+    def write(self, writer_class, data):
+        out = io.BytesIO()
+        writer = writer_class(out)
+        # Writes of any size
+        for offset in range(0, len(data), 100003):
+            writer.write(data[offset:offset + 100003])
+        writer.close()
+        return out.getvalue()
+
+    def assertStream(self, argv, stream, data):
+        path = os.path.join(self.tmp, "stream")
+        with open(path, "wb") as out:
+            out.write(stream)
+        self.assertTested(argv + ["-t"], path)
+        proc = subprocess.run(
+            argv + ["-d", "-c", path],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        self.assertEqual(proc.returncode, 0, proc.stderr)
+        self.assertEqual(proc.stdout, data)
+
+    def test_xz_stored_writer(self):
+        for size in self.SIZES:
+            data = noise("xz", size)
+            stream = self.write(archive._XzStoredWriter, data)
+            self.assertEqual(len(stream) % 4, 0, size)
+            self.assertEqual(lzma.decompress(stream), data, size)
+            if program("xz"):
+                self.assertStream(["xz"], stream, data)
+
+    def test_gzip_stored_writer(self):
+        for size in self.SIZES:
+            data = noise("gzip", size)
+            stream = self.write(archive._GzipStoredWriter, data)
+            self.assertEqual(gzip.decompress(stream), data, size)
+            if program("gzip"):
+                self.assertStream(["gzip"], stream, data)
+
+    @unittest.skipUnless(program("zstd"), "zstd is not installed")
+    def test_zstd_raw_frame(self):
+        for size in self.SIZES:
+            data = noise("zstd", size)
+            self.assertStream(
+                ["zstd", "-q"],
+                archive._zstd_raw_frame(data),
+                data
+            )
+
+    # Members expected to be stored
+    STORED = ("reports/host1.tar.xz", "reports/host2.tar.gz",
+              "reports/host3.tar.bz2")
+
+    def recording(self, writer_class):
+        """
+        Returns a stored writer factory recording in self.stored how many
+        bytes it is given.
+        """
+        self.stored = 0
+
+        def stored(fileobj):
+            writer = writer_class(fileobj)
+            write = writer.write
+
+            def record(data):
+                self.stored += len(data)
+                return write(data)
+
+            writer.write = record
+            return writer
+
+        return stored
+
+    def assertStored(self):
+        self.assertEqual(
+            self.stored,
+            sum(len(MEMBERS[member]) for member in self.STORED)
+        )
+
+    @unittest.skipUnless(program("xz"), "xz is not installed")
+    def test_xz(self):
+        compressor = archive.Compressor(
+            "xz", "xz",
+            argv=["xz", "-1", "-c", "-q"],
+            stored=self.recording(archive._XzStoredWriter),
+        )
+        path = self.create(compressor)
+        self.assertStored()
+        self.assertTested(["xz", "-t"], path)
+
+    @unittest.skipUnless(program("gzip"), "gzip is not installed")
+    def test_gzip(self):
+        # As pigz, which may not be installed
+        compressor = archive.Compressor(
+            "gzip", "gz",
+            argv=["gzip", "-1", "-c"],
+            stored=self.recording(archive._GzipStoredWriter),
+        )
+        path = self.create(compressor)
+        self.assertStored()
+        self.assertTested(["gzip", "-t"], path)
+        with tarfile.open(path) as tar:
+            self.assertMembers(tar)
+
+    @unittest.skipUnless(program("zstd"), "zstd is not installed")
+    def test_zstd(self):
+        self.stored = 0
+        raw_frame = archive._zstd_raw_frame
+
+        def record(data):
+            self.stored += len(data)
+            return raw_frame(data)
+
+        with mock.patch.object(archive, "_zstd_raw_frame", record):
+            path = self.create(archive.get_compressor("zstd"))
+        self.assertStored()
+        self.assertTested(["zstd", "-t", "-q"], path)
+
+
+if __name__ == "__main__":
+    unittest.main()
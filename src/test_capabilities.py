@@ -0,0 +1,209 @@
+#!/usr/bin/python3
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from ovirt_log_collector.helper import capabilities
+
+
+# sos report --list-plugins of sos 4.5, shortened
+LIST_PLUGINS = """\
+
+sos report (version 4.5.0)
+
+The following plugins are currently enabled:
+
+ anaconda             Anaconda installer
+ block                Block device information
+ cgroups              Control groups subsystem
+ gluster              GlusterFS storage
+ libvirt              libvirt virtualization API
+ logs                 System logs
+ lvm2                 Logical Volume Manager 2
+ networking           Network and network devices configuration
+ ovirt                oVirt Engine
+ ovirt-engine-backup  oVirt engine backup
+ postgresql           PostgreSQL RDBMS
+ vdsm                 VDSM Plugin
+
+The following plugins are currently disabled:
+
+ abrt                 inactive       Automatic Bug Reporting Tool
+ apache               inactive       Apache http daemon
+ ceph_mon             inactive       CEPH mon
+
+The following options are available for ALL plugins:
+
+ timeout                   -1              Timeout in seconds for plugin to \
+finish all collections
+ cmd-timeout               -1              Timeout in seconds for individual \
+commands to finish
+ postproc                  on              Enable post-processing collected \
+plugin data
+
+The following plugin options are available:
+
+ apache.log                off             gathers all apache logs
+ gluster.dump              off             enable glusterdump support
+ gluster.get-state         off             enable get-state command
+ logs.all_logs             off             collect all log files defined in \
+configuration files
+ lvm2.lvmdump              off             collect an lvmdump tarball
+ networking.traceroute     off             collect a traceroute to \
+www.example.com
+ ovirt.sensitive_keys      ENGINE_DB_PASSWORD:ENGINE_PKI_TRUST_STORE_PASSWORD \
+Sensitive keys to be masked
+ postgresql.dbname                         database name to dump for \
+pg_dump
+ vdsm.logsize              10              limit on log size
+
+ Profiles: boot, cluster, container, debug, desktop, hardware,
+           identity, memory, network, openstack, performance,
+           security, services, storage, sysmgmt, system, virt, webserver
+
+ 18 profiles, 15 plugins
+"""
+
+
+class ParsePluginsTest(unittest.TestCase):
+
+    def test_list_plugins(self):
+        plugins, options = capabilities.parse_plugins(LIST_PLUGINS)
+        self.assertEqual(
+            plugins,
+            {
+                "anaconda", "block", "cgroups", "gluster", "libvirt", "logs",
+                "lvm2", "networking", "ovirt", "ovirt-engine-backup",
+                "postgresql", "vdsm", "abrt", "apache", "ceph_mon",
+            }
+        )
+        self.assertEqual(
+            options,
+            {
+                "apache.log", "gluster.dump", "gluster.get-state",
+                "logs.all_logs", "lvm2.lvmdump", "networking.traceroute",
+                "ovirt.sensitive_keys", "postgresql.dbname", "vdsm.logsize",
+            }
+        )
+
+    def test_options_for_all_plugins(self):
+        plugins, options = capabilities.parse_plugins(LIST_PLUGINS)
+        for option in ("timeout", "cmd-timeout", "postproc"):
+            self.assertNotIn(option, plugins)
+            self.assertNotIn(option, options)
+
+    def test_empty(self):
+        self.assertEqual(capabilities.parse_plugins(""), (set(), set()))
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "cache", "capabilities.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_missing(self):
+        cache = capabilities.Cache.load(self.path)
+        self.assertIsNone(cache.version("host1"))
+        self.assertIsNone(cache.get("host1", "4.5.0"))
+        # Nothing to store
+        cache.save()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_corrupted(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, "w") as cache_file:
+            cache_file.write('{"host1": ')
+        cache = capabilities.Cache.load(self.path)
+        self.assertEqual(cache.entries, {})
+        cache.put("host1", "4.5.0", {"vdsm"}, set())
+        cache.save()
+        self.assertEqual(
+            capabilities.Cache.load(self.path).get("host1", "4.5.0"),
+            ({"vdsm"}, set())
+        )
+
+    def test_round_trip(self):
+        plugins, options = capabilities.parse_plugins(LIST_PLUGINS)
+        cache = capabilities.Cache.load(self.path)
+        cache.put("host1", "4.5.0", plugins, options)
+        cache.save()
+
+        loaded = capabilities.Cache.load(self.path)
+        self.assertEqual(loaded.version("host1"), "4.5.0")
+        self.assertEqual(loaded.get("host1", "4.5.0"), (plugins, options))
+        # sos was updated since
+        self.assertIsNone(loaded.get("host1", "4.5.1"))
+        self.assertIsNone(loaded.get("host2", "4.5.0"))
+
+    def test_concurrent_runs(self):
+        first = capabilities.Cache.load(self.path)
+        second = capabilities.Cache.load(self.path)
+        first.put("host1", "4.5.0", {"vdsm"}, set())
+        second.put("host2", "4.4", {"block"}, {"block.lsof"})
+        second.put("host1", "4.5.1", {"vdsm", "ovirt"}, set())
+        second.save()
+        first.save()
+
+        loaded = capabilities.Cache.load(self.path)
+        # The last saved wins
+        self.assertEqual(loaded.version("host1"), "4.5.0")
+        self.assertEqual(
+            loaded.get("host2", "4.4"),
+            ({"block"}, {"block.lsof"})
+        )
+
+    def test_threads(self):
+        cache = capabilities.Cache.load(self.path)
+        errors = []
+
+        def run(thread):
+            try:
+                for i in range(100):
+                    cache.put(
+                        "host%d-%d" % (thread, i),
+                        "4.5.0",
+                        {"vdsm"},
+                        set()
+                    )
+                    if i % 10 == 0:
+                        cache.save()
+                cache.save()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [
+            threading.Thread(target=run, args=(thread,))
+            for thread in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        with open(self.path) as cache_file:
+            self.assertEqual(len(json.load(cache_file)), 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
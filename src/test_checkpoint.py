@@ -0,0 +1,127 @@
+#!/usr/bin/python3
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from ovirt_log_collector.helper import checkpoint
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        self.path = os.path.join(self.base, "checkpoint.jsonl")
+        self.report = os.path.join(self.base, "host1", "sosreport.tar.xz")
+        os.makedirs(os.path.dirname(self.report))
+        with open(self.report, "wb") as report:
+            report.write(b"report of host1")
+
+    def tearDown(self):
+        shutil.rmtree(self.base)
+
+    def done(self, hostname="host1", checksum=None):
+        journal = checkpoint.Checkpoint.create(self.path)
+        journal.host_done(
+            hostname,
+            [
+                checkpoint.artifact(self.base, os.path.dirname(self.report)),
+                checkpoint.artifact(self.base, self.report, checksum),
+            ],
+            manifest={"address": hostname},
+        )
+        journal.phase_done("engine", [], plugins=["ovirt"])
+        return journal
+
+    def resumed(self, hostname="host1"):
+        return checkpoint.Checkpoint.load(self.path).get_host(
+            hostname,
+            self.base
+        )
+
+    def rewrite(self, content):
+        with open(self.report, "wb") as report:
+            report.write(content)
+
+    def test_resume(self):
+        self.done()
+        loaded = checkpoint.Checkpoint.load(self.path)
+        self.assertIsNotNone(loaded.started)
+        self.assertEqual(
+            loaded.get_host("host1", self.base)["manifest"],
+            {"address": "host1"}
+        )
+        self.assertEqual(
+            loaded.get_phase("engine", self.base)["plugins"],
+            ["ovirt"]
+        )
+        self.assertIsNone(loaded.get_host("host2", self.base))
+        self.assertIsNone(loaded.get_phase("hypervisors", self.base))
+
+    def test_truncated_last_record(self):
+        self.done()
+        with open(self.path) as journal:
+            data = journal.read()
+        # Crashed while appending the host2 record
+        line = json.dumps({"host": "host2", "artifacts": []})
+        with open(self.path, "w") as journal:
+            journal.write(data + line[:len(line) // 2])
+        loaded = checkpoint.Checkpoint.load(self.path)
+        self.assertIsNone(loaded.get_host("host2", self.base))
+        self.assertIsNotNone(loaded.get_host("host1", self.base))
+
+        # The next record is not lost after the truncated one
+        loaded.host_done("host3", [])
+        loaded = checkpoint.Checkpoint.load(self.path)
+        self.assertIsNotNone(loaded.get_host("host3", self.base))
+        self.assertIsNotNone(loaded.get_host("host1", self.base))
+
+    def test_missing_artifact(self):
+        self.done()
+        os.unlink(self.report)
+        self.assertIsNone(self.resumed())
+
+    def test_missing_directory(self):
+        self.done()
+        shutil.rmtree(os.path.dirname(self.report))
+        self.assertIsNone(self.resumed())
+
+    def test_resized_artifact(self):
+        self.done()
+        self.rewrite(b"report of host1, truncated or grown")
+        self.assertIsNone(self.resumed())
+
+    def test_checksum(self):
+        with open(self.report, "rb") as report:
+            checksum = hashlib.sha256(report.read()).hexdigest()
+        self.done(checksum=checksum)
+        self.assertIsNotNone(self.resumed())
+
+        # Same size, other content
+        self.rewrite(b"report of host2")
+        self.assertIsNone(self.resumed())
+
+    def test_no_checksum(self):
+        self.done()
+        self.rewrite(b"report of host2")
+        self.assertIsNotNone(self.resumed())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,199 @@
+#!/usr/bin/python3
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import fnmatch
+import itertools
+import random
+import unittest
+
+from ovirt_log_collector.helper import hypervisors
+
+
+HOSTS = (
+    # data center, cluster, address
+    ("Default", "Default", "host1.example.com"),
+    ("Default", "Default", "host2.example.com"),
+    ("Default", "Default", "HOST3.Example.COM"),
+    ("Default", "gluster-01", "10.0.0.1"),
+    ("Default", "gluster-01", "10.0.0.12"),
+    ("dc.2", "cluster(a)", "node+1.example.com"),
+    ("dc.2", "cluster(a)", "node11.example.com"),
+    ("dc.2", "cluster$b", "node^2.example.com"),
+    ("dc.2", "cluster$b", "node|3.example.com"),
+    ("DC-3", "Cluster-A", "node{4}.example.com"),
+    ("DC-3", "cluster-a", "node\\5.example.com"),
+    ("dc-3", "cluster-a", "node6.example.com"),
+)
+
+PATTERNS = {
+    "datacenter": (
+        "Default", "dc.2", "dc?2", "dc*", "DC*", "[Dd][Cc]-3", "dc[!.]*",
+        "*", "missing", "dcx2",
+    ),
+    "cluster": (
+        "Default", "cluster(a)", "cluster(*", "cluster$b", "cluster?b",
+        "Cluster-*", "cluster-[a]", "[cC]luster-?", "*-01", "cluster",
+    ),
+    "host": (
+        "host1.example.com", "host?.example.com", "host*", "HOST*",
+        "host[12].example.com", "10.0.0.1", "10.0.0.1?", "10.0.0.*",
+        "node+1.example.com", "node+*", "node^2.example.com", "node|*",
+        "node{4}.example.com", "node\\5.example.com", "node[0-9]*",
+        "*.example.com", "*.EXAMPLE.com", "node.1.example.com",
+    ),
+}
+
+
+def reference(records, datacenters, clusters, hosts):
+    """
+    The hosts selected by the filter that HostFilter replaced: each
+    pattern matched with fnmatch, or looked up if it is a plain name.
+    """
+
+    def matches(name, patterns):
+        for pattern in patterns:
+            if any(c in pattern for c in "*?[]"):
+                if fnmatch.fnmatchcase(name, pattern):
+                    return True
+            elif name == pattern:
+                return True
+        return False
+
+    return set(
+        record for record in records
+        if (datacenters is None or matches(record.datacenter, datacenters))
+        and (clusters is None or matches(record.cluster.name, clusters))
+        and (hosts is None or matches(record.address, hosts))
+    )
+
+
+class HostFilterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = hypervisors.ENGINETree()
+        for dc, cluster, address in HOSTS:
+            self.tree.add_sortable(dc, (dc + cluster, cluster, False), address)
+        self.records = self.tree.get_sortable()
+
+    def select(self, datacenters=None, clusters=None, hosts=None):
+        return set(
+            hypervisors.HostFilter(datacenters, clusters, hosts).select(
+                self.tree
+            )
+        )
+
+    def addresses(self, **kwargs):
+        return sorted(record.address for record in self.select(**kwargs))
+
+    def assertSameAsReference(self, datacenters, clusters, hosts):
+        self.assertEqual(
+            self.select(datacenters, clusters, hosts),
+            reference(self.records, datacenters, clusters, hosts),
+            (datacenters, clusters, hosts)
+        )
+
+    def test_no_filter(self):
+        self.assertEqual(self.select(), set(self.records))
+
+    def test_empty(self):
+        self.assertEqual(self.select(hosts=()), set())
+
+    def test_each_pattern(self):
+        for which, patterns in PATTERNS.items():
+            for pattern in patterns:
+                self.assertSameAsReference(
+                    *[
+                        [pattern] if which == kind else None
+                        for kind in ("datacenter", "cluster", "host")
+                    ]
+                )
+
+    def test_pairs(self):
+        for which, patterns in PATTERNS.items():
+            for pair in itertools.combinations(patterns, 2):
+                self.assertSameAsReference(
+                    *[
+                        list(pair) if which == kind else None
+                        for kind in ("datacenter", "cluster", "host")
+                    ]
+                )
+
+    def test_random_combinations(self):
+        rand = random.Random(42)
+        for _ in range(500):
+            self.assertSameAsReference(*[
+                rand.sample(PATTERNS[kind], rand.randint(1, 3))
+                if rand.random() < 0.6 else None
+                for kind in ("datacenter", "cluster", "host")
+            ])
+
+    def test_question_mark(self):
+        self.assertEqual(
+            self.addresses(hosts=["host?.example.com"]),
+            ["host1.example.com", "host2.example.com"]
+        )
+        self.assertEqual(self.addresses(hosts=["10.0.0.1?"]), ["10.0.0.12"])
+
+    def test_brackets(self):
+        self.assertEqual(
+            self.addresses(hosts=["node[0-9]*"]),
+            ["node11.example.com", "node6.example.com"]
+        )
+        self.assertEqual(
+            self.addresses(datacenters=["dc[!.]*"]),
+            ["node6.example.com"]
+        )
+
+    def test_regex_metacharacters_are_literal(self):
+        for address in (
+            "node+1.example.com",
+            "node^2.example.com",
+            "node|3.example.com",
+            "node{4}.example.com",
+            "node\\5.example.com",
+        ):
+            self.assertEqual(self.addresses(hosts=[address]), [address])
+        # The dot of a plain name matches a dot only
+        self.assertEqual(self.addresses(hosts=["node.1.example.com"]), [])
+        self.assertEqual(
+            self.addresses(hosts=["node|*"]),
+            ["node|3.example.com"]
+        )
+        self.assertEqual(
+            self.addresses(clusters=["cluster(*"]),
+            ["node+1.example.com", "node11.example.com"]
+        )
+
+    def test_case_sensitive(self):
+        self.assertEqual(
+            self.addresses(hosts=["HOST*"]),
+            ["HOST3.Example.COM"]
+        )
+        self.assertEqual(
+            self.addresses(hosts=["host*"]),
+            ["host1.example.com", "host2.example.com"]
+        )
+        self.assertEqual(
+            self.addresses(datacenters=["dc-3"]),
+            ["node6.example.com"]
+        )
+        self.assertEqual(
+            self.addresses(clusters=["[cC]luster-?"]),
+            ["node6.example.com", "node\\5.example.com", "node{4}.example.com"]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
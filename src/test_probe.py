@@ -0,0 +1,149 @@
+#!/usr/bin/python3
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import unittest
+
+from ovirt_log_collector.__main__ import HostProbe
+
+
+PLUGINS = """\
+
+sos report (version 4.5.0)
+
+The following plugins are currently enabled:
+
+ block                Block device information
+ ovirt                oVirt Engine
+ vdsm                 VDSM Plugin
+
+The following plugins are currently disabled:
+
+ abrt                 inactive       Automatic Bug Reporting Tool
+
+The following options are available for ALL plugins:
+
+ timeout                   -1              Timeout in seconds for plugin
+ postproc                  on              Enable post-processing
+
+The following plugin options are available:
+
+ vdsm.logsize              10              limit on log size
+
+"""
+
+SPACE = (
+    "/dev/mapper/rhel-var_tmp   10475520   2158772   8316748      21% /var/tmp"
+)
+
+
+def output(plugins=PLUGINS, space=SPACE, version="4.5.0"):
+    sections = [("version", version)]
+    if plugins is None:
+        sections.append(("cached", ""))
+    else:
+        sections.append(("plugins", plugins))
+    if space is not None:
+        sections.append(("space", space))
+    sections.append(("load", "0.52 0.58 0.59 2/1043 123456"))
+    sections.append(("date", "2026-10-18T12:30:05+02:00"))
+    return "".join(
+        "== %s\n%s\n" % (name, content) for name, content in sections
+    )
+
+
+class HostProbeTest(unittest.TestCase):
+
+    def test_plugins(self):
+        probe = HostProbe.parse(output())
+        self.assertEqual(probe.sos_version, "4.5.0")
+        self.assertEqual(probe.version, (4, 5))
+        self.assertTrue(probe.listed_plugins)
+        self.assertEqual(probe.plugins, {"block", "ovirt", "vdsm", "abrt"})
+        self.assertEqual(probe.options, {"vdsm.logsize"})
+        self.assertEqual(probe.free_space, 8316748 * 1024)
+        self.assertEqual(probe.load, [0.52, 0.58, 0.59])
+        self.assertEqual(probe.time, "2026-10-18T12:30:05+02:00")
+        self.assertEqual(
+            probe.to_manifest(),
+            {
+                "time": "20261018123005",
+                "sos_version": "4.5.0",
+                "free_space": 8316748 * 1024,
+                "load": [0.52, 0.58, 0.59],
+            }
+        )
+
+    def test_cached(self):
+        probe = HostProbe.parse(output(plugins=None))
+        self.assertEqual(probe.sos_version, "4.5.0")
+        self.assertFalse(probe.listed_plugins)
+        self.assertEqual(probe.plugins, set())
+        self.assertEqual(probe.options, set())
+        self.assertEqual(probe.free_space, 8316748 * 1024)
+        self.assertEqual(probe.time, "2026-10-18T12:30:05+02:00")
+
+    def test_no_plugins_listed(self):
+        # Neither sos report nor sosreport could list them
+        probe = HostProbe.parse(output(plugins=""))
+        self.assertTrue(probe.listed_plugins)
+        self.assertEqual(probe.plugins, set())
+
+    def test_missing_space(self):
+        probe = HostProbe.parse(output(space=None))
+        self.assertIsNone(probe.free_space)
+        self.assertEqual(probe.load, [0.52, 0.58, 0.59])
+        self.assertEqual(probe.time, "2026-10-18T12:30:05+02:00")
+
+    def test_unexpected_space(self):
+        probe = HostProbe.parse(output(space="df: /var/tmp: No such file"))
+        self.assertIsNone(probe.free_space)
+
+    def test_sos_not_installed(self):
+        probe = HostProbe.parse(
+            output(plugins="", version="package sos is not installed")
+        )
+        self.assertIsNone(probe.sos_version)
+        self.assertIsNone(probe.version)
+
+    def test_failed(self):
+        probe = HostProbe.parse("")
+        self.assertIsNone(probe.sos_version)
+        self.assertFalse(probe.listed_plugins)
+        self.assertIsNone(probe.free_space)
+        self.assertIsNone(probe.load)
+        self.assertIsNone(probe.time)
+        self.assertIsNone(probe.to_manifest()["time"])
+
+    def test_command(self):
+        self.assertIn("= '4.5.0' ]", HostProbe.command("4.5.0"))
+        # Never a version of sos, so the plugins are listed
+        self.assertIn("= '-' ]", HostProbe.command(None))
+        self.assertIn("= '-' ]", HostProbe.command("4.5'; rm -rf /"))
+
+    def test_command_without_plugins(self):
+        command = HostProbe.command("4.5.0", list_plugins=False)
+        self.assertNotIn("--list-plugins", command)
+        self.assertNotIn("== cached", command)
+        self.assertIn("== date", command)
+        probe = HostProbe.parse(output(plugins=None).replace(
+            "== cached\n", ""
+        ))
+        self.assertFalse(probe.listed_plugins)
+        self.assertEqual(probe.sos_version, "4.5.0")
+        self.assertEqual(probe.time, "2026-10-18T12:30:05+02:00")
+
+
+if __name__ == "__main__":
+    unittest.main()